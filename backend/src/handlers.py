@@ -1,26 +1,71 @@
-import json 
+import os 
+import time 
 import datetime 
 import logging 
-from typing import Tuple  
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Dict  
 
 from utils_serverless.utils import StorageClient, NotebookRunner
+from utils_serverless.serialization import dumps, quantize_spec
 
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 MAX_AGE_SECONDS = 15 * 60 # 15 minutes 
+# Maximum number of notebooks executed concurrently by a single refresh request. 
+# Each worker drives its own kernel, so this bounds the number of live kernels. 
+MAX_WORKERS = int(os.environ.get("CHARTS_REFRESH_MAX_WORKERS", 4))
+# Where the data of charts is stored. 
+# - "inline": Datasets are stored within the spec. 
+# - "external": Datasets are uploaded as separate objects, and referenced by url within the spec. 
+DATASETS_MODE = os.environ.get("CHARTS_DATASETS_MODE", "inline")
+# Minimum number of significant digits kept for the floats in chart data, which are otherwise 
+# rounded to the digits displayed by their formats. 0 disables rounding. 
+SIGNIFICANT_DIGITS = int(os.environ.get("CHARTS_SIGNIFICANT_DIGITS", 0))
 
 sc = StorageClient()
 nbr = NotebookRunner()
 
 
+def refresh_schema(schema_name: str, force_refresh: bool) -> Dict[str, str]: 
+    """Optionally re-computes and uploads a single schema. 
+
+    Returns the status object reported for this schema by handler_charts_refresh. 
+    """
+    cur_dtime = datetime.datetime.now(datetime.timezone.utc)
+    blob, exists, age_seconds = sc.get_blob(f"schemas/{schema_name}.json", cur_dtime)
+    compute_schema = force_refresh or not exists or age_seconds >= MAX_AGE_SECONDS
+    if not compute_schema: 
+        return {"status": "use_cached"}
+    start_time = time.time()
+    ntbk_output = nbr.execute(schema_name)
+    # Timed here as nbr.execute only logs its runtime 
+    run_secs = time.time() - start_time
+    spec = ntbk_output['spec']
+    if SIGNIFICANT_DIGITS: 
+        spec = quantize_spec(spec, SIGNIFICANT_DIGITS)
+    if DATASETS_MODE == "external": 
+        spec = sc.upload_datasets(spec)
+    data = {
+        "timestamp": cur_dtime.isoformat(), 
+        "run_time_seconds": run_secs,
+        "cell_profile": ntbk_output['cell_profile'],
+        "spec": spec,
+        "width_paths": ntbk_output['width_paths'],
+        "css": ntbk_output['css'],
+    }
+    sc.upload(blob, dumps(data))
+    return {"status": "recomputed"}
+
+
 def handler_charts_refresh(request) -> Tuple[any, int]: 
     """Recalculates one or more chart objects 
     
     Matches incoming requests to one or more jupyter notebook(s). 
     Executes the notebook(s) and writes their outputs to a GCP bucket. 
     Notebooks are only executed if they are older than MAX_AGE_SECONDS. 
+    Up to MAX_WORKERS notebooks are executed concurrently. 
     
     Notebook output is a JSON object representing a compiled vega spec 
     that can be rendered as is on the client side. 
@@ -54,30 +99,20 @@ def handler_charts_refresh(request) -> Tuple[any, int]:
             ), 404 
 
     # Optionally re-compute and upload each schema
+    schema_names = set(schema_names) # ensure no duplicate computation 
     statuses = {}
     code = 200 
-    for schema_name in set(schema_names):  # ensure no duplicate computation 
-        try:
-            cur_dtime = datetime.datetime.now(datetime.timezone.utc)
-            blob, exists, age_seconds = sc.get_blob(f"schemas/{schema_name}.json", cur_dtime)
-            compute_schema = force_refresh or not exists or age_seconds >= MAX_AGE_SECONDS
-            if compute_schema:
-                status = "recomputed"
-                ntbk_output = nbr.execute(schema_name)
-                data = {
-                    "timestamp": cur_dtime.isoformat(), 
-                    "run_time_seconds": nbr.execute._decorated_run_time_seconds,
-                    "spec": ntbk_output['spec'],
-                    "width_paths": ntbk_output['width_paths'],
-                    "css": ntbk_output['css'],
-                }
-                sc.upload(blob, json.dumps(data))
-            else: 
-                status = "use_cached"
-            statuses[schema_name] = {"status": status}
-        except BaseException as e:
-            code = 500 
-            err_msg = str(e) or "Internal Server Error"
-            statuses[schema_name] = {"status": "failure", "error": str(err_msg)}
-            logger.error(err_msg)
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(schema_names)))) as executor: 
+        futures = {
+            schema_name: executor.submit(refresh_schema, schema_name, force_refresh)
+            for schema_name in schema_names
+        }
+        for schema_name, future in futures.items(): 
+            try:
+                statuses[schema_name] = future.result()
+            except BaseException as e:
+                code = 500 
+                err_msg = str(e) or "Internal Server Error"
+                statuses[schema_name] = {"status": "failure", "error": str(err_msg)}
+                logger.error(err_msg)
     return statuses, code
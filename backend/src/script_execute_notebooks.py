@@ -1,3 +1,4 @@
+import os 
 import logging
 import json 
 from pathlib import Path 
@@ -27,7 +28,20 @@ if __name__ == "__main__":
         '--output-dir', 
         help='Output directory where notebook outputs are written'
     )
+    parser.add_argument(
+        '--frame-cache-dir', 
+        help='Directory of the on disk cache of query dataframes, reused across runs'
+    )
+    parser.add_argument(
+        '--frame-cache-max-age', 
+        type=float, 
+        help='Age in seconds after which cached query dataframes are re-fetched'
+    )
     args = parser.parse_args()
+    if args.frame_cache_dir: 
+        os.environ["QUERY_DF_CACHE_DIR"] = args.frame_cache_dir
+    if args.frame_cache_max_age is not None: 
+        os.environ["QUERY_DF_CACHE_MAX_AGE_SECONDS"] = str(args.frame_cache_max_age)
 
     output_path = Path(args.output_dir)
     if not output_path.exists() and output_path.is_dir(): 
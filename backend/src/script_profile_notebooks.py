@@ -1,5 +1,7 @@
+import os 
 import logging
 import time 
+import argparse 
 from collections import defaultdict
 
 from utils_serverless.utils import NotebookRunner
@@ -7,6 +9,22 @@ from utils_serverless.utils import NotebookRunner
 # disable logs 
 logging.basicConfig(level=logging.CRITICAL)
 
+parser = argparse.ArgumentParser(description='Profile the runtime of all notebooks.')
+parser.add_argument(
+    '--frame-cache-dir', 
+    help='Directory of the on disk cache of query dataframes, reused across runs'
+)
+parser.add_argument(
+    '--frame-cache-max-age', 
+    type=float, 
+    help='Age in seconds after which cached query dataframes are re-fetched'
+)
+args = parser.parse_args()
+if args.frame_cache_dir: 
+    os.environ["QUERY_DF_CACHE_DIR"] = args.frame_cache_dir
+if args.frame_cache_max_age is not None: 
+    os.environ["QUERY_DF_CACHE_MAX_AGE_SECONDS"] = str(args.frame_cache_max_age)
+
 num_iters = 3
 nb_runner = NotebookRunner()
 
@@ -25,4 +43,4 @@ avg_runtimes = {k: sum(v) / len(v) for k, v in runtimes.items()}
 for k in sorted(avg_runtimes, key=avg_runtimes.get): 
     fname = str(nb_runner.ntbk_name_path_map[k].name)
     print(f"Runtime of {fname:<40} | {avg_runtimes[k]:.2f} seconds.")
-print(f"\nEstimated cumulative runtime: {sum(*avg_runtimes.values())}\n")
+print(f"\nEstimated cumulative runtime: {sum(avg_runtimes.values()):.2f} seconds.\n")
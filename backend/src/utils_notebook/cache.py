@@ -0,0 +1,394 @@
+"""On disk caches shared by the notebooks of a refresh. 
+
+- QueryCache: results of QueryManager methods (see cached_query). 
+- SeasonStore: raw entities of season series, so that only new seasons are fetched. 
+- FrameCache: dataframes returned by subgrounds queries (see CachingSubgrounds). 
+"""
+import os 
+import json 
+import time 
+import fcntl 
+import pickle 
+import hashlib 
+import inspect 
+import logging 
+import threading 
+from pathlib import Path 
+from functools import wraps 
+from contextlib import contextmanager
+from dataclasses import dataclass, field 
+from typing import Any, Optional, Type
+
+import pandas as pd 
+import pyarrow as pa 
+from subgrounds.subgrounds import Subgrounds, FieldPath
+from subgrounds.pagination import PaginationStrategy, LegacyStrategy
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(path: Path): 
+    """Exclusive lock across threads and processes, backed by a lock file.
+
+    The lock file may be removed (see remove_lock_file) between opening and locking it, in 
+    which case the lock is taken again on the file that is now at path. 
+    """
+    path = Path(path)
+    while True: 
+        f = path.open("w")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try: 
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino: 
+                break 
+        except FileNotFoundError: 
+            pass 
+        f.close()
+    try: 
+        yield 
+    finally: 
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+def remove_lock_file(path: Path) -> bool: 
+    """Removes a lock file of file_lock, unless the lock is held. Returns whether it was removed."""
+    try: 
+        f = Path(path).open("r")
+    except FileNotFoundError: 
+        return False 
+    with f: 
+        try: 
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError: 
+            return False 
+        try: 
+            # Removed while holding the lock, so that waiters locking the removed file retry
+            if os.stat(path).st_ino != os.fstat(f.fileno()).st_ino: 
+                return False 
+            os.unlink(path)
+            return True 
+        except FileNotFoundError: 
+            return False 
+        finally: 
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _remove_stale_locks(path: Path, keys: set) -> None: 
+    # Lock files of removed entries (or of queries that failed), other than those being held 
+    for fpath in path.glob("*.lock"): 
+        if fpath.stem not in keys: 
+            remove_lock_file(fpath)
+
+
+def _write_atomic(fpath: Path, value: Any) -> None: 
+    # Write then rename so readers never observe a partially written file 
+    fpath_tmp = fpath.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with fpath_tmp.open("wb") as f: 
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(fpath_tmp, fpath)
+
+
+class QueryCache: 
+    """Disk backed cache of query results, shared by all notebooks running on a machine. 
+
+    Notebooks are executed in separate kernels (or threads), so results are stored as 
+    files in a shared directory rather than in memory. Entries expire after ttl_seconds, 
+    and only the max_entries most recently written entries are kept. 
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 300, max_entries: int = 64): 
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds 
+        self.max_entries = max_entries 
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["QueryCache"]: 
+        """Creates a cache from environment variables. Caching is disabled if QUERY_CACHE_DIR isn't set."""
+        path = os.environ.get("QUERY_CACHE_DIR")
+        if not path: 
+            return None 
+        return cls(
+            path, 
+            ttl_seconds=float(os.environ.get("QUERY_CACHE_TTL_SECONDS", 300)), 
+            max_entries=int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", 64)), 
+        )
+
+    @staticmethod
+    def key(*parts) -> str: 
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> Path: 
+        return self.path / f"{key}.pkl"
+
+    def lock(self, key: str): 
+        """Exclusive lock on a key, held while computing a missing entry so that 
+        concurrent notebooks wait for the result rather than issuing the same query. 
+        """
+        return file_lock(self.path / f"{key}.lock")
+
+    def get(self, key: str) -> Optional[Any]: 
+        fpath = self._entry_path(key)
+        try: 
+            age_seconds = time.time() - fpath.stat().st_mtime 
+            if age_seconds >= self.ttl_seconds: 
+                return None 
+            with fpath.open("rb") as f: 
+                return pickle.load(f)
+        except FileNotFoundError: 
+            return None 
+
+    def set(self, key: str, value: Any) -> None: 
+        _write_atomic(self._entry_path(key), value)
+        self.evict()
+
+    def evict(self) -> None: 
+        """Removes expired entries, then the oldest entries in excess of max_entries, and the 
+        lock files of removed entries. 
+        """
+        now = time.time()
+        entries = []
+        for fpath in self.path.glob("*.pkl"): 
+            try: 
+                mtime = fpath.stat().st_mtime 
+            except FileNotFoundError: 
+                continue 
+            entries.append((mtime, fpath))
+        entries = sorted(entries, reverse=True)
+        kept = set()
+        for i, (mtime, fpath) in enumerate(entries): 
+            if i >= self.max_entries or now - mtime >= self.ttl_seconds: 
+                fpath.unlink(missing_ok=True)
+            else: 
+                kept.add(fpath.stem)
+        _remove_stale_locks(self.path, kept)
+
+    def clear(self) -> None: 
+        for fpath in self.path.glob("*.pkl"): 
+            fpath.unlink(missing_ok=True)
+        _remove_stale_locks(self.path, set())
+
+
+class SeasonStore: 
+    """Persistent store of the raw (pre-aggregation) frames fetched for season series queries. 
+
+    Unlike QueryCache entries, stored frames never expire. Queries use them to only 
+    fetch the seasons that are newer than those already stored. 
+    """
+
+    def __init__(self, path: str): 
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["SeasonStore"]: 
+        """Creates a store from environment variables. Disabled if QUERY_STORE_DIR isn't set."""
+        path = os.environ.get("QUERY_STORE_DIR")
+        return cls(path) if path else None 
+
+    key = staticmethod(QueryCache.key)
+
+    def load(self, key: str) -> Optional[pd.DataFrame]: 
+        try: 
+            with (self.path / f"{key}.pkl").open("rb") as f: 
+                return pickle.load(f)
+        except FileNotFoundError: 
+            return None 
+
+    def save(self, key: str, df: pd.DataFrame) -> None: 
+        _write_atomic(self.path / f"{key}.pkl", df)
+
+
+class FrameCache: 
+    """Disk backed columnar cache of the dataframes returned by subgrounds queries. 
+
+    Frames are stored as Arrow IPC files, which keep their pandas dtypes and are memory 
+    mapped when read back. Each file records the query fingerprint and creation time in 
+    its schema metadata. Entries expire after max_age_seconds, and the oldest entries are 
+    removed once the cache grows beyond max_bytes. 
+    """
+
+    METADATA_KEY = b"beanstalk_analytics"
+
+    def __init__(self, path: str, max_age_seconds: float = 300, max_bytes: int = 64 * 2**20): 
+        self.path = Path(path)
+        self.max_age_seconds = max_age_seconds 
+        self.max_bytes = max_bytes 
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["FrameCache"]: 
+        """Creates a cache from environment variables. Disabled if QUERY_DF_CACHE_DIR isn't set."""
+        path = os.environ.get("QUERY_DF_CACHE_DIR")
+        if not path: 
+            return None 
+        return cls(
+            path, 
+            max_age_seconds=float(os.environ.get("QUERY_DF_CACHE_MAX_AGE_SECONDS", 300)), 
+            max_bytes=int(os.environ.get("QUERY_DF_CACHE_MAX_BYTES", 64 * 2**20)), 
+        )
+
+    key = staticmethod(QueryCache.key)
+
+    def _entry_path(self, key: str) -> Path: 
+        return self.path / f"{key}.arrow"
+
+    def lock(self, key: str): 
+        return file_lock(self.path / f"{key}.lock")
+
+    def get(self, key: str) -> Optional[pd.DataFrame]: 
+        fpath = self._entry_path(key)
+        try: 
+            with pa.memory_map(str(fpath), "r") as source: 
+                table = pa.ipc.open_file(source).read_all()
+        except FileNotFoundError: 
+            return None 
+        metadata = json.loads(table.schema.metadata[self.METADATA_KEY])
+        if time.time() - metadata["created_at"] >= self.max_age_seconds: 
+            return None 
+        return table.to_pandas()
+
+    def set(self, key: str, df: pd.DataFrame, fingerprint: str) -> bool: 
+        """Stores a frame, returns False if the frame can't be represented in arrow 
+        (e.g. integers that overflow 64 bits) in which case it isn't cached. 
+        """
+        try: 
+            table = pa.Table.from_pandas(df)
+        except (pa.ArrowException, TypeError, ValueError) as e: 
+            logger.info(f"Frame not cached, conversion to arrow failed: {e}")
+            return False 
+        metadata = {"created_at": time.time(), "fingerprint": fingerprint}
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}), 
+            self.METADATA_KEY: json.dumps(metadata).encode("utf-8"), 
+        })
+        fpath = self._entry_path(key)
+        fpath_tmp = fpath.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with pa.OSFile(str(fpath_tmp), "wb") as sink: 
+            with pa.ipc.new_file(sink, table.schema) as writer: 
+                writer.write_table(table)
+        os.replace(fpath_tmp, fpath)
+        self.evict()
+        return True 
+
+    def evict(self) -> None: 
+        """Removes expired entries, then the oldest entries until the cache fits in max_bytes, 
+        and the lock files of removed entries. 
+        """
+        now = time.time()
+        entries = []
+        for fpath in self.path.glob("*.arrow"): 
+            try: 
+                stat = fpath.stat()
+            except FileNotFoundError: 
+                continue 
+            entries.append((stat.st_mtime, stat.st_size, fpath))
+        total_bytes = 0 
+        kept = set()
+        for mtime, size, fpath in sorted(entries, reverse=True): 
+            total_bytes += size 
+            if total_bytes > self.max_bytes or now - mtime >= self.max_age_seconds: 
+                fpath.unlink(missing_ok=True)
+            else: 
+                kept.add(fpath.stem)
+        _remove_stale_locks(self.path, kept)
+
+    def clear(self) -> None: 
+        for fpath in self.path.glob("*.arrow"): 
+            fpath.unlink(missing_ok=True)
+        _remove_stale_locks(self.path, set())
+
+
+@dataclass
+class CachingSubgrounds(Subgrounds): 
+    """Subgrounds client that reads query_df results from a FrameCache when available. 
+
+    Queries are fingerprinted by their graphql documents, so any notebook issuing the same 
+    query (on any kernel, or from the CLI scripts) reuses the stored frame. Queries returning 
+    several frames aren't cached. 
+    """
+
+    frame_cache: Optional[FrameCache] = field(default_factory=FrameCache.from_env)
+
+    def fingerprint(
+        self, 
+        fpaths: list[FieldPath], 
+        columns: Optional[list[str]], 
+        concat: bool, 
+        pagination_strategy: Optional[Type[PaginationStrategy]], 
+    ) -> str: 
+        req = self.mk_request(fpaths)
+        return "\n".join([
+            *[doc.url for doc in req.documents], 
+            req.graphql, 
+            repr(columns), 
+            repr(concat), 
+            getattr(pagination_strategy, "__name__", repr(pagination_strategy)), 
+        ])
+
+    def query_df(
+        self, 
+        fpaths, 
+        columns: Optional[list[str]] = None, 
+        concat: bool = False, 
+        pagination_strategy: Optional[Type[PaginationStrategy]] = LegacyStrategy, 
+    ): 
+        if self.frame_cache is None: 
+            return super().query_df(fpaths, columns, concat, pagination_strategy)
+        fpaths_list = []
+        for fpath in (fpaths if isinstance(fpaths, list) else [fpaths]): 
+            selected = fpath._auto_select()
+            fpaths_list.extend(selected if isinstance(selected, list) else [selected])
+        fingerprint = self.fingerprint(fpaths_list, columns, concat, pagination_strategy)
+        key = self.frame_cache.key(fingerprint)
+        with self.frame_cache.lock(key): 
+            df = self.frame_cache.get(key)
+            if df is not None: 
+                logger.info("Frame cache hit")
+                return df 
+            df = super().query_df(fpaths, columns, concat, pagination_strategy)
+            if isinstance(df, pd.DataFrame): 
+                self.frame_cache.set(key, df, fingerprint)
+            return df 
+
+
+def query_cache_key(manager, name: str, args, kwargs) -> str: 
+    """Key of the result of a QueryManager method, by subgraph, method name and arguments. 
+
+    Arguments are bound to the signature of the method (with defaults applied), so calls that 
+    pass the same arguments differently (e.g. q.query_seasons() and q.query_seasons(None)) 
+    share a key. 
+    """
+    signature = inspect.signature(getattr(type(manager), name))
+    bound = signature.bind(manager, *args, **kwargs)
+    bound.apply_defaults()
+    arguments = {}
+    for param, value in list(bound.arguments.items())[1:]: 
+        if signature.parameters[param].kind is inspect.Parameter.VAR_KEYWORD: 
+            arguments.update(value)
+        else: 
+            arguments[param] = value 
+    return manager.cache.key(getattr(manager.bs, "_url", None), name, sorted(arguments.items()))
+
+
+def cached_query(fn): 
+    """Caches the result of a QueryManager method in the manager's QueryCache. 
+
+    Results are keyed by subgraph, method name and arguments. 
+    """
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs): 
+        cache: Optional[QueryCache] = self.cache 
+        if cache is None: 
+            return fn(self, *args, **kwargs)
+        key = query_cache_key(self, fn.__name__, args, kwargs)
+        with cache.lock(key): 
+            value = cache.get(key)
+            if value is None: 
+                value = fn(self, *args, **kwargs)
+                cache.set(key, value)
+            else: 
+                logger.info(f"Query cache hit for {fn.__name__}")
+        return value 
+    return wrapper 
@@ -0,0 +1,110 @@
+from typing import Optional, List
+
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling
+
+    Points are split into n_out - 2 buckets of (roughly) equal size between the first and last
+    point, which are always kept. From each bucket we keep the point forming the largest triangle
+    with the point kept from the previous bucket and the average point of the next bucket, which
+    preserves the visual shape of a series far better than decimation does.
+    Assumes that x is sorted.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average point of the next bucket (the last point for the last bucket)
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_start = end if i + 2 < len(edges) else n - 1
+        x_avg = x[next_start:next_end].mean()
+        y_avg = y[next_start:next_end].mean()
+        # Twice the area of the triangle formed with point a and the average point
+        areas = np.abs(
+            (x[a] - x_avg) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (y_avg - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the points kept by min/max bucketing
+
+    Points are split into n_out / 2 buckets of equal size, keeping the minimum and maximum of
+    each bucket (as well as the first and last point), so that peaks are never dropped.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    n_buckets = (n_out - 2) // 2
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    starts = edges[:-1]
+    # reduceat computes the min/max of each bucket in a single pass
+    mins = np.minimum.reduceat(y, starts)
+    maxs = np.maximum.reduceat(y, starts)
+    bucket = np.repeat(np.arange(n_buckets), np.diff(edges))
+    is_min = y == mins[bucket]
+    is_max = y == maxs[bucket]
+    # First occurrence of the min and max of each bucket
+    idx = np.arange(n)
+    first_min = np.full(n_buckets, n)
+    first_max = np.full(n_buckets, n)
+    np.minimum.at(first_min, bucket[is_min], idx[is_min])
+    np.minimum.at(first_max, bucket[is_max], idx[is_max])
+    return np.unique(np.concatenate([[0, n - 1], first_min, first_max]))
+
+
+DOWNSAMPLING_METHODS = {
+    "lttb": lttb_indices,
+    "minmax": minmax_indices,
+}
+
+
+def downsample_timeseries(
+    df: pd.DataFrame,
+    timestamp_col: str,
+    metrics: List[str],
+    max_points: int,
+    method: str = "lttb",
+    wide: bool = True,
+    keep: Optional[pd.Series] = None,
+) -> pd.DataFrame:
+    """Drops the rows of df that aren't needed to draw each metric with at most max_points points
+
+    Each metric is downsampled separately, and rows are kept for the union of the timestamps
+    selected for any metric, so that stacked metrics and tooltips stay aligned on the same
+    timestamps. The latest timestamp is always kept, as are rows for which keep is True.
+
+    df is either in wide form (a column per metric) or, when wide is False, in long-wide form
+    (see vega.wide_to_longwide) with the metric of each row in column "variable".
+    """
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"Invalid downsampling method {method}")
+    indices_fn = DOWNSAMPLING_METHODS[method]
+    ts = df[timestamp_col]
+    selected = [ts.to_numpy()[[ts.argmax()]]]
+    if keep is not None:
+        selected.append(ts[keep].to_numpy())
+    for m in metrics:
+        series = (
+            df[[timestamp_col, m]].set_axis([timestamp_col, "value"], axis=1)
+            if wide else
+            df.loc[df["variable"] == m, [timestamp_col, "value"]]
+        )
+        series = series.dropna().sort_values(timestamp_col)
+        if series.empty:
+            continue
+        t = series[timestamp_col]
+        x = (t.astype("int64") if pd.api.types.is_datetime64_any_dtype(t) else t).to_numpy(float)
+        y = series["value"].to_numpy(float)
+        selected.append(t.to_numpy()[indices_fn(x, y, max_points)])
+    return df.loc[ts.isin(np.concatenate(selected))]
@@ -0,0 +1,77 @@
+import logging
+from typing import Iterable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Length of hex encoded addresses, including the 0x prefix
+ADDRESS_LENGTH = 42
+
+# Columns that are merged on across frames, and keep their dtype so that both sides of a merge match
+MERGE_KEYS = ("season",)
+
+
+def is_address_column(s: pd.Series) -> bool:
+    """Whether every (non-null) value of s is a hex encoded address string. """
+    if s.dtype != object:
+        return False
+    values = s.dropna()
+    if not len(values) or pd.api.types.infer_dtype(values, skipna=True) != "string":
+        return False
+    return bool((values.str.len().eq(ADDRESS_LENGTH) & values.str.startswith("0x")).all())
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """Bytes held by df, including the python objects of object columns. """
+    return int(df.memory_usage(deep=True).sum())
+
+
+def downcast_numeric(s: pd.Series, floats: bool = False) -> pd.Series:
+    """Downcasts integer columns (and float columns if floats=True) to the smallest width that 
+    holds their values. Other columns are returned as they are. 
+    """
+    if pd.api.types.is_bool_dtype(s):
+        return s
+    if pd.api.types.is_integer_dtype(s):
+        return pd.to_numeric(s, downcast="integer")
+    if floats and pd.api.types.is_float_dtype(s):
+        # float32 is only used if every value is within 5e-4 of its float64 value
+        return pd.to_numeric(s, downcast="float")
+    return s
+
+
+def compact_dtypes(
+    df: pd.DataFrame, name: str = "frame", keys: Iterable[str] = MERGE_KEYS, floats: bool = False
+) -> pd.DataFrame:
+    """Compacts the columns of df, in place, and returns df.
+
+    - Columns of addresses become categoricals. Addresses (42 character hex strings) are 
+      otherwise held as a python object per row. As categoricals, each distinct address is 
+      stored once and rows hold integer codes, which is also what groupby hashes.
+    - Integer columns are downcast to the smallest width that holds their values, and so are 
+      float columns if floats=True. 
+    - Columns in keys (merge keys, by default season) keep their dtype. 
+
+    Memory before and after compaction is logged.
+
+    Downcast columns keep their width in arithmetic with scalars, so cast them back (with 
+    astype) before computing values that can overflow, or float values that are charted, since 
+    float32 values serialize with rounding noise (0.1 becomes 0.10000000149011612). 
+
+    Pass observed=True when grouping by a categorical address, so that only the addresses in
+    the frame are grouped. With pandas < 2, observed groups are in order of appearance rather
+    than sorted, so sort the result by index when its order matters.
+    """
+    before = memory_usage(df)
+    keys = set(keys)
+    for col in df.columns:
+        if col in keys:
+            continue
+        if is_address_column(df[col]):
+            df[col] = df[col].astype("category")
+        else:
+            df[col] = downcast_numeric(df[col], floats=floats)
+    after = memory_usage(df)
+    logger.info(f"Compacted dtypes of {name}: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return df
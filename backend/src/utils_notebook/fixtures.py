@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import subgrounds.client as client
+
+logger = logging.getLogger(__name__)
+
+
+class SubgraphFixtures:
+    """Store of subgraph responses, keyed by the GraphQL request that produced them.
+
+    Fixtures are recorded while running notebooks against the live subgraph (see
+    install_recorder), and served back by backend/tests/replay_subgraph.py, so that
+    notebooks can be run and benchmarked deterministically without network access.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(query_str: str, variables: Optional[Dict[str, Any]] = None) -> str:
+        request = json.dumps({"query": query_str, "variables": variables or {}}, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _fixture_path(self, key: str) -> Path:
+        return self.path / f"{key}.json"
+
+    def load(self, query_str: str, variables: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Returns the response data recorded for a request, or None if it wasn't recorded."""
+        try:
+            with self._fixture_path(self.key(query_str, variables)).open("r") as f:
+                return json.load(f)["data"]
+        except FileNotFoundError:
+            return None
+
+    def save(self, query_str: str, variables: Optional[Dict[str, Any]], data: Dict[str, Any]) -> None:
+        fpath = self._fixture_path(self.key(query_str, variables))
+        fpath_tmp = fpath.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with fpath_tmp.open("w") as f:
+            json.dump({"query": query_str, "variables": variables or {}, "data": data}, f)
+        os.replace(fpath_tmp, fpath)
+
+
+_recorder_lock = threading.Lock()
+_recorder: Optional[SubgraphFixtures] = None
+
+
+def install_recorder(path: str) -> SubgraphFixtures:
+    """Records all subgrounds requests (and schema introspection) made in this process."""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is not None:
+            return _recorder
+        _recorder = fixtures = SubgraphFixtures(path)
+        query, get_schema = client.query, client.get_schema
+
+        def query_recorded(url: str, query_str: str, variables: Dict[str, Any] = {}) -> Dict[str, Any]:
+            data = query(url, query_str, variables)
+            fixtures.save(query_str, variables, data)
+            return data
+
+        def get_schema_recorded(url: str) -> Dict[str, Any]:
+            data = get_schema(url)
+            fixtures.save(client.INTROSPECTION_QUERY, {}, data)
+            return data
+
+        client.query = query_recorded
+        client.get_schema = get_schema_recorded
+        logger.info(f"Recording subgraph requests to {path}")
+        return fixtures
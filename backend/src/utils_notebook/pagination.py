@@ -0,0 +1,291 @@
+"""Concurrent pagination of large entity sets (e.g. farmers, plots, silo asset snapshots).
+
+Queries are split into ranges of ids or seasons, which are paginated concurrently and 
+concatenated back in order. Requests share a keep-alive connection pool (see PooledClient).
+"""
+import os
+import threading
+from dataclasses import dataclass, field, replace
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+import subgrounds.client as client
+from subgrounds.subgrounds import Subgrounds, FieldPath
+from subgrounds.dataframe_utils import df_of_json
+from subgrounds.pagination import ShallowStrategy
+from subgrounds.pagination.utils import PAGE_SIZE
+
+# Maximum number of requests sent to the subgraph at once, across all concurrent queries
+MAX_IN_FLIGHT = int(os.environ.get("SUBGRAPH_MAX_IN_FLIGHT", 8))
+
+# Boundaries splitting hex encoded ids (e.g. addresses) into 16 ranges. Ids are strings,
+# so ranges are lexicographic. Two digit prefixes are used since they are valid as Bytes too.
+HEX_ID_BOUNDARIES = [f"0x{i:x}0" for i in range(1, 16)]
+# Boundaries splitting ids that are decimal integers encoded as strings (e.g. plot indices)
+DECIMAL_ID_BOUNDARIES = [str(i) for i in range(1, 10)]
+
+
+class PooledClient:
+    """Replacement for subgrounds.client.query that sends requests over a shared
+    keep-alive session, with at most max_in_flight requests in flight at once.
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.semaphore = threading.BoundedSemaphore(max_in_flight)
+
+    def query(self, url: str, query_str: str, variables: Dict[str, Any] = {}) -> Dict[str, Any]:
+        # Same request and error handling as subgrounds.client.query
+        with self.semaphore:
+            resp = self.session.post(
+                url,
+                json=(
+                    {'query': query_str}
+                    if variables == {}
+                    else {'query': query_str, 'variables': variables}
+                ),
+                headers={'Content-Type': 'application/json'}
+            ).json()
+        try:
+            return resp['data']
+        except KeyError as exn:
+            raise Exception(resp['errors']) from exn
+
+
+_pooled_client: Optional[PooledClient] = None
+_pooled_client_lock = threading.Lock()
+
+
+def install_pooled_client() -> PooledClient:
+    """Routes all subgrounds queries in this process through a single PooledClient."""
+    global _pooled_client
+    with _pooled_client_lock:
+        if _pooled_client is None:
+            _pooled_client = PooledClient()
+            client.query = _pooled_client.query
+    return _pooled_client
+
+
+def _range_where(split_field: str, lo: Any, hi: Any) -> Dict[str, Any]:
+    where = {}
+    if lo is not None:
+        where[f"{split_field}_gte"] = lo
+    if hi is not None:
+        where[f"{split_field}_lt"] = hi
+    return where
+
+
+def numeric_boundaries(
+    sg: Subgrounds,
+    list_field: FieldPath,
+    split_field: str,
+    where: Optional[Dict[str, Any]] = None,
+    num_splits: int = MAX_IN_FLIGHT,
+) -> List[int]:
+    """Boundaries splitting the values of an integer field (e.g. season) of the entities of 
+    list_field (e.g. bs.Query.seasons) into num_splits ranges of equal width. The min and max 
+    values are looked up with two single entity queries. 
+    """
+    def query_extreme(direction):
+        q = list_field(first=1, orderBy=split_field, orderDirection=direction, where=where or {})
+        df = sg.query_df([getattr(q, split_field)], pagination_strategy=None)
+        return int(df.iloc[0, 0]) if len(df) else None
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        lo, hi = executor.map(query_extreme, ["asc", "desc"])
+    if lo is None or hi <= lo:
+        return []
+    return sorted(set(np.linspace(lo, hi, num_splits + 1, dtype=int)[1:-1].tolist()))
+
+
+def query_df_split(
+    sg: Subgrounds,
+    make_query: Callable,
+    select: Callable,
+    boundaries: List[Any],
+    split_field: str = "id",
+    descending: bool = False,
+    first: Optional[int] = None,
+    pagination_strategy=ShallowStrategy,
+    max_workers: int = MAX_IN_FLIGHT,
+) -> pd.DataFrame:
+    """Queries a list field by splitting it into key ranges that are paginated concurrently.
+
+    make_query maps a where filter to the list field (with the filter merged into its own), and
+    select maps the list field to the field paths to query. boundaries split the values of
+    split_field into consecutive ranges, the first and last of which are open ended so that
+    every entity belongs to exactly one range.
+
+    The query must be ordered by split_field (ascending, or descending if descending=True).
+    Ranges are then concatenated in key order, and truncated to first rows, which gives the
+    same frame as paginating the whole query with pagination_strategy.
+    """
+    bounds = [None, *boundaries, None]
+    wheres = [_range_where(split_field, lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    if descending:
+        wheres = wheres[::-1]
+
+    def query_range(where):
+        q = make_query(where)
+        return sg.query_df(select(q), pagination_strategy=pagination_strategy)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(wheres)))) as executor:
+        dfs = list(executor.map(query_range, wheres))
+    # Empty frames have no columns (or dtypes), so they are left out of the concatenation
+    dfs_nonempty = [df for df in dfs if len(df)]
+    if not dfs_nonempty:
+        return dfs[0]
+    df = pd.concat(dfs_nonempty, ignore_index=True)
+    if first is not None:
+        df = df.iloc[:first]
+    return df
+
+
+@dataclass
+class PagedQuery:
+    """Query of fields of the entities of a list field (e.g. bs.Query.seasons), paginated 
+    on order_by like ShallowStrategy does: pages of entities with order_by values after 
+    the last one of the previous page. 
+    """
+    list_field: FieldPath
+    fields: List[str]
+    where: Dict[str, Any] = field(default_factory=dict)
+    order_by: str = "id"
+    descending: bool = False
+    first: int = 100000
+
+    @property
+    def prefix(self) -> str:
+        """Prefix of the names of the queried columns."""
+        return f"{self.list_field._name()}_"
+
+    def query(self, first: int, cursor: Any = None) -> FieldPath:
+        where = dict(self.where)
+        if cursor is not None:
+            where[f"{self.order_by}_{'lt' if self.descending else 'gt'}"] = cursor
+        return self.list_field(
+            first=first,
+            orderBy=self.order_by,
+            orderDirection="desc" if self.descending else "asc",
+            where=where,
+        )
+
+    def fpaths(self, q: FieldPath) -> List[FieldPath]:
+        fpaths = []
+        for f in self.fields:
+            # Fields of nested entities are dotted paths (e.g. "deposits.bdv")
+            fpath = q
+            for name in f.split("."):
+                fpath = getattr(fpath, name)
+            selected = fpath._auto_select()
+            fpaths.extend(selected if isinstance(selected, list) else [selected])
+        return fpaths
+
+
+def query_df_batch(sg: Subgrounds, queries: List[PagedQuery]) -> List[pd.DataFrame]:
+    """Queries several list fields together, with a single GraphQL document per page. 
+
+    Every request holds the next page of each query that isn't exhausted (as fields with 
+    distinct aliases), so the number of round trips is that of the longest query rather 
+    than the sum over all queries. The response is split back into one frame per query, 
+    formatted like sg.query_df would. 
+    """
+    pages: List[List[pd.DataFrame]] = [[] for _ in queries]
+    num_entities = [0] * len(queries)
+    cursors: List[Any] = [None] * len(queries)
+    active = list(range(len(queries)))
+    while active:
+        page_queries = {}
+        for i in active:
+            q = queries[i]
+            page_queries[i] = q.query(min(PAGE_SIZE, q.first - num_entities[i]), cursors[i])
+        page_fpaths = {
+            i: queries[i].fpaths(q) + [getattr(q, queries[i].order_by)]
+            for i, q in page_queries.items()
+        }
+        json_data = sg.query_json(
+            [fpath for fpaths in page_fpaths.values() for fpath in fpaths],
+            pagination_strategy=None
+        )
+        for i, q in page_queries.items():
+            entities = json_data[0].get(q._name(use_aliases=True)) or []
+            pages[i].append(df_of_json(json_data, page_fpaths[i][:-1]))
+            num_entities[i] += len(entities)
+            if entities:
+                cursors[i] = entities[-1][queries[i].order_by]
+            if len(entities) < PAGE_SIZE or num_entities[i] >= queries[i].first:
+                active.remove(i)
+    dfs = []
+    for query_pages in pages:
+        # Empty pages have no columns (or dtypes), so they are left out of the concatenation
+        query_pages_nonempty = [df for df in query_pages if len(df)]
+        if not query_pages_nonempty:
+            dfs.append(query_pages[0])
+        else:
+            dfs.append(pd.concat(query_pages_nonempty, ignore_index=True))
+    return dfs
+
+
+def query_df_iter(sg: Subgrounds, query: PagedQuery) -> Iterator[pd.DataFrame]:
+    """Yields the frame of each page of query as soon as it is fetched, formatted like 
+    sg.query_df would format the page. 
+
+    Pages are fetched one after the other, and only one of them is held at a time, so the 
+    rows of large queries (e.g. flattened nested entities) can be reduced page by page. 
+    Pages without rows aren't yielded. 
+    """
+    num_entities = 0
+    cursor = None
+    while num_entities < query.first:
+        q = query.query(min(PAGE_SIZE, query.first - num_entities), cursor)
+        fpaths = query.fpaths(q) + [getattr(q, query.order_by)]
+        json_data = sg.query_json(fpaths, pagination_strategy=None)
+        entities = json_data[0].get(q._name(use_aliases=True)) or []
+        df = df_of_json(json_data, fpaths[:-1])
+        if len(df):
+            yield df
+        num_entities += len(entities)
+        if len(entities) < PAGE_SIZE:
+            break
+        cursor = entities[-1][query.order_by]
+
+
+def query_df_split_reduce(
+    sg: Subgrounds,
+    query: PagedQuery,
+    reduce: Callable[[pd.DataFrame], pd.DataFrame],
+    boundaries: List[Any],
+    max_workers: int = MAX_IN_FLIGHT,
+) -> pd.DataFrame:
+    """Queries a list field in key ranges paginated concurrently (like query_df_split), 
+    reducing the frame of each page with reduce as soon as the page is fetched. 
+
+    Only reduced pages are kept, so memory tracks the size of the result rather than the 
+    number of rows queried. reduce must not depend on other pages, e.g. it can aggregate 
+    nested entities (deposits) by entity of the list field (farmers), since all nested 
+    entities of an entity are in the same page. 
+
+    boundaries split the values of query.order_by into ranges, as in query_df_split. Reduced 
+    pages are concatenated in key order. query.first limits the number of entities per range. 
+    """
+    bounds = [None, *boundaries, None]
+    wheres = [_range_where(query.order_by, lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    if query.descending:
+        wheres = wheres[::-1]
+
+    def query_range(where):
+        return [reduce(df) for df in query_df_iter(sg, replace(query, where={**query.where, **where}))]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(wheres)))) as executor:
+        dfs = [df for dfs_range in executor.map(query_range, wheres) for df in dfs_range]
+    # Empty frames have no columns (or dtypes), so they are left out of the concatenation
+    dfs_nonempty = [df for df in dfs if len(df)]
+    if not dfs_nonempty:
+        return dfs[0] if dfs else pd.DataFrame()
+    return pd.concat(dfs_nonempty, ignore_index=True)
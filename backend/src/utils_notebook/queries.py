@@ -1,16 +1,30 @@
 import json
-from dataclasses import dataclass
+from contextlib import ExitStack
+from dataclasses import dataclass, field, replace
 from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from subgrounds.subgrounds import Subgrounds, Subgraph
 from subgrounds.subgraph import SyntheticField
-from subgrounds.pagination import ShallowStrategy
+from subgrounds.pagination import LegacyStrategy, ShallowStrategy
 
 from .utils import remove_prefix
 from .testing import validate_season_series
 from .constants import ADDR_BEANSTALK
+from .cache import QueryCache, SeasonStore, cached_query, query_cache_key
+from .pagination import (
+    DECIMAL_ID_BOUNDARIES,
+    HEX_ID_BOUNDARIES,
+    PagedQuery,
+    query_df_batch,
+    query_df_split,
+    query_df_split_reduce,
+)
+from .seasons import SeasonIndex
+from .dtypes import compact_dtypes
+from .snapshots import SnapshotAggregation, SnapshotField
 
 
 def synthetic_field_float_div_precision(
@@ -30,8 +44,29 @@ def synthetic_field_float_div_precision(
     )
 
 
-def get_last_row(row):
-    return row.iloc[-1]
+# Reducers of the fields of snapshot entities, for seasons with multiple snapshots
+FIELD_DAILY_SNAPSHOTS = SnapshotAggregation((
+    SnapshotField('id', 'last'),
+    SnapshotField('deltaHarvestablePods', 'sum', 1e6),
+    SnapshotField('deltaHarvestedPods', 'sum', 1e6),
+    SnapshotField('harvestablePods', 'max', 1e6),
+    SnapshotField('harvestedPods', 'max', 1e6),
+    SnapshotField('deltaPods', 'sum', 1e6),
+    SnapshotField('deltaSoil', 'sum', 1e6),
+    SnapshotField('numberOfSowers', 'last'),
+    SnapshotField('numberOfSows', 'last'),
+    SnapshotField('podIndex', 'last', 1e6),
+    SnapshotField('podRate', 'last'),
+    SnapshotField('realRateOfReturn', 'last'),
+    SnapshotField('sownBeans', 'max', 1e6),
+    SnapshotField('timestamp', 'max'),
+    SnapshotField('unharvestablePods', 'max', 1e6),
+    SnapshotField('soil', 'last', 1e6),
+    SnapshotField('temperature', 'last'),
+))
+SILO_DAILY_SNAPSHOTS = SnapshotAggregation((
+    SnapshotField('deltaBeanMints', 'sum', 1e6),
+))
 
 
 def adjust_precision(df, precisions):
@@ -41,12 +76,153 @@ def adjust_precision(df, precisions):
             df[col] = df[col] / precision
 
 
+def fill_missing_seasons(df: pd.DataFrame, fill_value=0, season_col: str = "season") -> pd.DataFrame:
+    """Adds a row for each season missing between the first and last season of df, with 
+    fill_value in every other column. 
+
+    Useful for queries of events, which aren't emitted every season. df must have a single 
+    row per season. Returns the rows sorted by season (no rows if df is empty). 
+    """
+    df = df.set_index(season_col)
+    if not df.index.is_unique:
+        duplicates = df.index[df.index.duplicated()].unique().tolist()
+        raise ValueError(f"Can't fill missing seasons, seasons have multiple rows: {duplicates}")
+    if not len(df):
+        return df.reset_index()
+    szns = pd.RangeIndex(df.index.min(), df.index.max() + 1, name=season_col)
+    return df.reindex(szns, fill_value=fill_value).reset_index()
+
+
+@dataclass
+class QueryPlan:
+    """Subgraph queries needed by a QueryManager query, and the processing of their 
+    frames (one per query, with column prefixes removed) into the query's result. 
+
+    Planning queries separately from executing them lets QueryManager.query_batch send 
+    the subgraph queries of several QueryManager queries together. 
+    """
+    queries: List[PagedQuery]
+    process: Callable[..., Any]
+
+    @staticmethod
+    def combine(plans: List["QueryPlan"], process: Callable[..., Any]) -> "QueryPlan":
+        """Plan of the queries of all plans, processed by calling process with the 
+        result of each plan. 
+        """
+        bounds = np.cumsum([0] + [len(plan.queries) for plan in plans])
+
+        def process_combined(*dfs):
+            return process(*[
+                plan.process(*dfs[lo:hi]) for plan, lo, hi in zip(plans, bounds[:-1], bounds[1:])
+            ])
+        return QueryPlan([q for plan in plans for q in plan.queries], process_combined)
+
+
 @dataclass
 class QueryManager:
 
     sg: Subgrounds
     bs: Subgraph
+    # Query results are shared with all other notebooks through this cache (if enabled)
+    cache: Optional[QueryCache] = field(default_factory=QueryCache.from_env)
+    # Previously fetched season series (if enabled), so that only new seasons are fetched
+    season_store: Optional[SeasonStore] = field(default_factory=SeasonStore.from_env)
+
+    def _query_df(self, query: PagedQuery):
+        """Queries all pages of query, with columns prefixed by query.prefix."""
+        return self.sg.query_df(
+            query.fpaths(query.query(query.first)),
+            pagination_strategy=ShallowStrategy
+        )
+
+    def _execute(self, plan: QueryPlan):
+        """Queries the subgraph for the queries of a plan, and processes the results.
+
+        Multiple queries are sent together, in a single request per page.
+        """
+        if len(plan.queries) == 1:
+            dfs = [self._query_df(plan.queries[0])]
+        else:
+            dfs = query_df_batch(self.sg, plan.queries)
+        return plan.process(*[remove_prefix(df, q.prefix) for df, q in zip(dfs, plan.queries)])
+
+    def _plan_incremental(self, query: PagedQuery, process: Callable[[pd.DataFrame], Any]) -> QueryPlan:
+        """Plans a season series query, only fetching seasons that are not in the season store.
+
+        The latest stored season is always re-fetched, as entities for the current season are
+        updated until it ends. process is called with the raw (unaggregated) frame for all seasons.
+        """
+        store = self.season_store
+        if store is None:
+            return QueryPlan([query], process)
+        key = store.key(getattr(self.bs, "_url", None), query.prefix, sorted(query.where.items()), query.fields)
+        df_stored = store.load(key)
+        if df_stored is None or not len(df_stored):
+            def process_all(df):
+                store.save(key, df)
+                return process(df)
+            return QueryPlan([query], process_all)
+        last_season = int(df_stored.season.max())
+        query_new = replace(query, where={
+            **query.where,
+            "season_gte": max(query.where.get("season_gte", last_season), last_season)
+        })
+
+        def process_merged(df_new):
+            df = df_stored
+            if len(df_new):
+                df = pd.concat(
+                    [df_stored.loc[df_stored.season < last_season], df_new[df_stored.columns]],
+                    ignore_index=True
+                )
+            store.save(key, df)
+            return process(df)
+        return QueryPlan([query_new], process_merged)
+
+    def query_batch(self, queries: List[Tuple[str, Dict[str, Any]]]) -> List[Any]:
+        """Runs several queries, returning their results in order, e.g. 
+
+        df_barn, df_szns = q.query_batch([
+            ("query_barn", {}), 
+            ("query_seasons", {"extra_cols": ["beans"]}), 
+        ])
+
+        Results are shared with the query methods through the query cache. The subgraph 
+        queries of all queries that aren't cached are sent together, in a single GraphQL 
+        document per page. Only queries that are planned (with a _plan_ method) can be 
+        batched, others (e.g. query_season_index, query_plots) raise a ValueError. 
+        """
+        plan_fns = []
+        for name, _ in queries: 
+            plan_fn = getattr(self, f"_plan_{name[len('query_'):]}", None) if name.startswith("query_") else None
+            if plan_fn is None: 
+                raise ValueError(f"{name} can't be batched, call it directly instead")
+            plan_fns.append(plan_fn)
+        results = [None] * len(queries)
+        keys = [
+            query_cache_key(self, name, (), kwargs) if self.cache is not None else None
+            for name, kwargs in queries
+        ]
+        with ExitStack() as stack:
+            if self.cache is not None:
+                # Locks are always acquired in the same order, so concurrent batches can't deadlock
+                for key in sorted(set(keys)):
+                    stack.enter_context(self.cache.lock(key))
+            plans = {}
+            for i, (name, kwargs) in enumerate(queries):
+                if self.cache is not None:
+                    results[i] = self.cache.get(keys[i])
+                if results[i] is None:
+                    plans[i] = plan_fns[i](**kwargs)
+            if plans:
+                values = self._execute(QueryPlan.combine(list(plans.values()), lambda *values: values))
+                for i, value in zip(plans, values):
+                    results[i] = value
+                    if self.cache is not None:
+                        self.cache.set(keys[i], value)
+        return results
 
+    @cached_query
     def query_seasons(self, extra_cols=None, **kwargs):
         """Returns dataframe of form 
 
@@ -57,26 +233,31 @@ class QueryManager:
 
         You can add more columns to this df via extra_cols 
         """
-        sg = self.sg
+        return self._execute(self._plan_seasons(extra_cols, **kwargs))
+
+    def _plan_seasons(self, extra_cols=None, **kwargs):
         bs = self.bs
         # Create sythetic field for timestamp
         bs.Season.timestamp = bs.Season.createdAt
-        precisions = {
-            "beans": 1e6
-        }
-        query_kwargs_default = {"orderBy": "season", "orderDirection": "asc"}
+        query_kwargs_default = {"orderBy": "season", "orderDirection": "asc", "first": 100000}
         query_kwargs = {**query_kwargs_default, **kwargs}
         extra_cols = extra_cols or []
-        q = bs.Query.seasons(first=100000, **query_kwargs)
-        df = sg.query_df(
-            [
-                q.season,
-                q.timestamp,
-                *[getattr(q, col) for col in extra_cols]
-            ],
-            pagination_strategy=ShallowStrategy
+        query = PagedQuery(
+            bs.Query.seasons,
+            ["season", "timestamp", *extra_cols],
+            where=query_kwargs.pop("where", {}),
+            order_by=query_kwargs.pop("orderBy"),
+            descending=query_kwargs.pop("orderDirection") == "desc",
+            first=query_kwargs.pop("first"),
         )
-        df = remove_prefix(df, "seasons_")
+        if query_kwargs:
+            raise ValueError(f"Unsupported seasons query arguments {list(query_kwargs)}")
+        return self._plan_incremental(query, self._process_seasons)
+
+    def _process_seasons(self, df):
+        precisions = {
+            "beans": 1e6
+        }
         adjust_precision(df, precisions)
         df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
         df = df.sort_values("timestamp").reset_index(drop=True)
@@ -95,6 +276,19 @@ class QueryManager:
         validate_season_series(df, allow_missing=False)
         return df
 
+    @cached_query
+    def query_season_index(self, extra_cols=None, **kwargs) -> SeasonIndex:
+        """Returns the seasons of query_seasons (called with the same arguments) as a SeasonIndex, 
+        which attaches timestamps (and extra_cols) to frames by season without merging, e.g. 
+
+        df = q.query_season_index().attach_timestamps(df)
+
+        The index is built from the (cached) result of query_seasons, so notebooks using either 
+        share a single fetch of the seasons, and is itself cached. 
+        """
+        return SeasonIndex.from_frame(self.query_seasons(extra_cols, **kwargs))
+
+    @cached_query
     def query_rewards_fertilizer(self):
         """Returns dataframe of form 
 
@@ -106,32 +300,24 @@ class QueryManager:
         Season axis begins at 6076 (first season the Reward event was emitted)
         and has no missing values. 
         """
-        sg = self.sg
+        return self._execute(self._plan_rewards_fertilizer())
+
+    def _plan_rewards_fertilizer(self):
         bs = self.bs
         synthetic_field_float_div_precision(
             bs.Reward, 'reward_fertilized_beans', 'toFertilizer', 1e6
         )
-        q = bs.Query.rewards(orderBy="blockNumber",
-                             orderDirection="asc", first=100000)
-        df = sg.query_df(
-            [
-                q.season,
-                q.reward_fertilized_beans,
-            ],
-            pagination_strategy=ShallowStrategy
+        query = PagedQuery(
+            bs.Query.rewards, ["season", "reward_fertilized_beans"], order_by="blockNumber"
         )
-        df = remove_prefix(df, 'rewards_').sort_values(
-            'season').reset_index(drop=True)
-        szns = df.season.unique()
-        missing_szns = [i for i in range(
-            df.season.min(), df.season.max()) if i not in szns]
-        df_missing_szns = pd.DataFrame(
-            [{"season": i, "reward_fertilized_beans": 0} for i in missing_szns])
-        df = pd.concat([df, df_missing_szns]).sort_values(
-            'season').reset_index(drop=True)
+        return QueryPlan([query], self._process_rewards_fertilizer)
+
+    def _process_rewards_fertilizer(self, df):
+        df = fill_missing_seasons(df, fill_value=0)
         validate_season_series(df, allow_missing=False)
         return df
 
+    @cached_query
     def query_fertilizer_tokens(self):
         """Returns dataframe of form 
 
@@ -146,7 +332,9 @@ class QueryManager:
         Season axis begins at 6074. Note that there are two entries for season 
         6074, for fertilizer issued pre-post replant. 
         """
-        sg = self.sg
+        return self._execute(self._plan_fertilizer_tokens())
+
+    def _plan_fertilizer_tokens(self):
         bs = self.bs
         synthetic_field_float_div_precision(
             bs.FertilizerToken, 'start_bpf', 'startBpf', 1e6
@@ -154,23 +342,15 @@ class QueryManager:
         synthetic_field_float_div_precision(
             bs.FertilizerToken, 'end_bpf', 'id', 1e6
         )
-        ft = bs.Query.fertilizerTokens(
-            first=100000,
-            orderBy="humidity",
-            orderDirection="desc"
-        )
-        df = sg.query_df(
-            [
-                ft.season,
-                ft.supply,
-                ft.humidity,
-                ft.start_bpf,
-                ft.end_bpf,
-            ],
-            pagination_strategy=ShallowStrategy
+        query = PagedQuery(
+            bs.Query.fertilizerTokens,
+            ["season", "supply", "humidity", "start_bpf", "end_bpf"],
+            order_by="humidity",
+            descending=True,
         )
-        return remove_prefix(df, "fertilizerTokens_")
+        return QueryPlan([query], lambda df: df)
 
+    @cached_query
     def query_barn(self):
         """Returns dataframe of form 
 
@@ -188,12 +368,25 @@ class QueryManager:
 
         Season axis begins at 6074 and has no missing values.     
         """
-        df_szns = self.query_seasons(where={"season_gte": 6074})
-        df_rewards_fert = self.query_rewards_fertilizer()
-        df_fert_tokens = self.query_fertilizer_tokens()
+        return self._execute(self._plan_barn())
+
+    def _plan_barn(self):
+        # Seasons, rewards and fertilizer tokens are queried together
+        return QueryPlan.combine(
+            [
+                self._plan_seasons(where={"season_gte": 6074}),
+                self._plan_rewards_fertilizer(),
+                self._plan_fertilizer_tokens(),
+            ],
+            self._process_barn
+        )
+
+    def _process_barn(self, df_szns, df_rewards_fert, df_fert_tokens):
+        # Rewards are attached to seasons by position, fertilizer tokens are merged as 
+        # several tokens can be issued in the same season 
         df = (
-            df_szns
-            .merge(df_rewards_fert, how="left", on="season")
+            SeasonIndex.from_frame(df_rewards_fert)
+            .attach(df_szns)
             .merge(df_fert_tokens, how="left", on="season")
         )
         df = df.fillna(0)
@@ -224,83 +417,35 @@ class QueryManager:
         validate_season_series(df)
         return df
 
+    @cached_query
     def query_field_daily_snapshots(self, fields=None):
-        sg = self.sg
+        return self._execute(self._plan_field_daily_snapshots(fields))
+
+    def _plan_field_daily_snapshots(self, fields=None):
         bs = self.bs
         bs.FieldDailySnapshot.timestamp = bs.FieldDailySnapshot.createdAt
-        precisions = {
-            'id': None,
-            'deltaHarvestablePods': 1e6,
-            'deltaHarvestedPods': 1e6,
-            'harvestablePods': 1e6,
-            'harvestedPods': 1e6,
-            'deltaPods': 1e6,
-            'deltaSoil': 1e6,
-            'numberOfSowers': None,
-            'numberOfSows': None,
-            'podIndex': 1e6,
-            'podRate': None,
-            'realRateOfReturn': None,
-            'season': None,
-            'sownBeans': 1e6,
-            'timestamp': None,
-            'numberOfSowers': None,
-            'numberOfSows': None,
-            'unharvestablePods': 1e6,
-            'soil': 1e6,
-            'sownBeans': 1e6,
-            'temperature': None,
-        }
-        aggs = {
-            'id': get_last_row,
-            'deltaHarvestablePods': 'sum',
-            'deltaHarvestedPods': 'sum',
-            'harvestablePods': 'max',
-            'harvestedPods': 'max',
-            'deltaPods': 'sum',
-            'deltaSoil': 'sum',
-            'numberOfSowers': 'sum',
-            'numberOfSows': 'sum',
-            'podIndex': get_last_row,
-            'podRate': get_last_row,
-            'realRateOfReturn': get_last_row,
-            'sownBeans': 'sum',
-            'timestamp': "max",
-            'numberOfSowers': get_last_row,
-            'numberOfSows': get_last_row,
-            'unharvestablePods': 'max',
-            'soil': get_last_row,
-            'sownBeans': 'max',
-            'temperature': get_last_row,
-        }
-        fields = fields or list(precisions.keys())
+        fields = fields or FIELD_DAILY_SNAPSHOTS.names
         if "season" not in fields:
             fields.append("season")
         if "timestamp" not in fields:
             fields.append("timestamp")
-        fs = bs.Query.fieldDailySnapshots(
-            orderBy="createdAt",
-            orderDirection="asc",
+        query = PagedQuery(
+            bs.Query.fieldDailySnapshots,
+            fields,
+            where={"field": ADDR_BEANSTALK},
+            order_by="createdAt",
             first=10000,
-            where={"field": ADDR_BEANSTALK}
         )
-        df = sg.query_df(
-            [getattr(fs, key) for key in fields],
-            pagination_strategy=ShallowStrategy
+        return self._plan_incremental(
+            query, lambda df: self._process_field_daily_snapshots(df, FIELD_DAILY_SNAPSHOTS)
         )
-        df = remove_prefix(df, "fieldDailySnapshots_")
-        adjust_precision(df, precisions)
+
+    def _process_field_daily_snapshots(self, df, spec: SnapshotAggregation):
+        adjust_precision(df, spec.precisions)
         if "timestamp" in df.columns:
             df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
         # Perform aggregations to deal with duplicate seasons (pauses in beanstalk)
-        df = (
-            df
-            .sort_values("timestamp")
-            .reset_index(drop=True)
-            .groupby('season')
-            .agg({k: v for k, v in aggs.items() if k in df.columns})
-            .reset_index()
-        )
+        df = spec.aggregate(df)
         validate_season_series(df, allow_missing=True)
         return df
 
@@ -313,46 +458,106 @@ class QueryManager:
             records = json.loads(f.read())['records']
         return pd.DataFrame(records)
 
+    @cached_query
     def query_silo_daily_snapshots(self, fields=None):
-        sg = self.sg
+        return self._execute(self._plan_silo_daily_snapshots(fields))
+
+    def _plan_silo_daily_snapshots(self, fields=None):
         bs = self.bs
         bs.SiloDailySnapshot.timestamp = bs.SiloDailySnapshot.createdAt
-        precisions = {
-            'deltaBeanMints': 1e6,
-        }
-        aggs = {
-            'deltaBeanMints': 'sum',
-        }
-        fields = fields or list(precisions.keys())
+        fields = fields or SILO_DAILY_SNAPSHOTS.names
         if "season" not in fields:
             fields.append("season")
         if "timestamp" not in fields:
             fields.append("timestamp")
-        silo_snaps = bs.Query.siloDailySnapshots(
-            orderBy="createdAt",
-            orderDirection="asc",
-            first=100000,
+        query = PagedQuery(
+            bs.Query.siloDailySnapshots,
+            fields,
             where={
                 "silo": ADDR_BEANSTALK,
                 "season_gte": 6074  # TODO: remove this condition once silo history exists in subgraph
-            }
+            },
+            order_by="createdAt",
         )
-        df = sg.query_df(
-            [getattr(silo_snaps, key) for key in fields],
-            pagination_strategy=ShallowStrategy
+        return self._plan_incremental(
+            query, lambda df: self._process_silo_daily_snapshots(df, SILO_DAILY_SNAPSHOTS)
         )
-        df = remove_prefix(df, "siloDailySnapshots_")
+
+    def _process_silo_daily_snapshots(self, df, spec: SnapshotAggregation):
         # Combine pre and post replant data (no seasons in common so outer join)
         df = df.merge(self._silo_emissions_pre_replant(), how="outer",)
-        adjust_precision(df, precisions)
+        adjust_precision(df, spec.precisions)
         # Perform aggregations to deal with duplicate seasons (pauses in beanstalk)
-        df = (
+        df = spec.aggregate(df)
+        validate_season_series(df, allow_missing=True)
+        return df
+
+    @cached_query
+    def query_farmers_deposited_bdv(self):
+        """Returns dataframe of form 
+
+        #   Column    Dtype  
+        ---  ------    -----  
+        0   address   category
+        1   bdv       float64
+
+        with the total bdv of the silo deposits of each farmer (other than beanstalk itself), 
+        sorted by address. Farmers without deposits are left out. Addresses are categorical 
+        (see dtypes.compact_dtypes). 
+
+        Farmers are paginated concurrently in ranges of addresses, and the deposits of each 
+        page are summed by farmer as soon as the page is fetched, so the frame of all deposits 
+        (one row per deposit) is never held in memory. 
+        """
+        query = PagedQuery(
+            self.bs.Query.farmers,
+            ["id", "deposits.bdv"],
+            where={'silo_': {'id_not': ADDR_BEANSTALK}},
+        )
+        df = query_df_split_reduce(
+            self.sg, query, lambda df: self._reduce_farmers_deposited_bdv(df, query.prefix), HEX_ID_BOUNDARIES
+        )
+        if not len(df):
+            return pd.DataFrame({"address": pd.Series(dtype="category"), "bdv": pd.Series(dtype=float)})
+        return compact_dtypes(df, name="farmers_deposited_bdv")
+
+    def _reduce_farmers_deposited_bdv(self, df, prefix):
+        df = remove_prefix(df, prefix)
+        df = remove_prefix(df, "deposits_")
+        adjust_precision(df, {"bdv": 1e6})
+        return (
             df
-            .sort_values("timestamp")
-            .reset_index()
-            .groupby('season')
-            .agg({k: v for k, v in aggs.items() if k in df.columns})
+            .rename(columns={"id": "address"})
+            .groupby("address")[["bdv"]]
+            .sum()
             .reset_index()
         )
-        validate_season_series(df, allow_missing=True)
-        return df
+
+    @cached_query
+    def query_plots(self):
+        """Returns dataframe of form 
+
+        #   Column    Dtype   
+        ---  ------    -----   
+        0   pods      float64 
+        1   address   category
+
+        with a row for each plot, and the address of the farmer holding it. Addresses are 
+        categorical (see dtypes.compact_dtypes), so group by them with observed=True. 
+        """
+        # Plots (with ids that are the plot index) are split into ranges of ids that are fetched concurrently
+        df = query_df_split(
+            self.sg,
+            lambda where: self.bs.Query.plots(first=100000, where=where),
+            lambda plots: [
+                plots.pods,
+                plots.farmer.id
+            ],
+            DECIMAL_ID_BOUNDARIES,
+            first=100000,
+            pagination_strategy=LegacyStrategy,
+        )
+        df = remove_prefix(df, "plots_")
+        df = df.rename(columns={"farmer_id": "address"})
+        adjust_precision(df, {"pods": 1e6})
+        return compact_dtypes(df, name="plots")
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+
+
+@dataclass(frozen=True)
+class SeasonIndex:
+    """Per-season columns (e.g. the timestamp of each season), stored as dense arrays.
+
+    The values of season s are at position s - first_season of each array, so looking up a
+    season doesn't require a search, and columns are joined onto frames by position instead
+    of with a hash merge. Seasons missing between the first and last season have null values.
+    """
+    first_season: int
+    columns: Dict[str, np.ndarray]
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, season_col: str = "season") -> "SeasonIndex":
+        """Creates an index from a frame with a single row per season, e.g. from query_seasons."""
+        df = df.set_index(season_col)
+        if not len(df.columns):
+            raise ValueError("Can't index seasons without any columns")
+        if not df.index.is_unique:
+            duplicates = df.index[df.index.duplicated()].unique().tolist()
+            raise ValueError(f"Can't index seasons, seasons have multiple rows: {duplicates}")
+        first_season = int(df.index.min())
+        df = df.reindex(pd.RangeIndex(first_season, int(df.index.max()) + 1))
+        return cls(first_season, {col: df[col].to_numpy() for col in df.columns})
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values())))
+
+    @property
+    def last_season(self) -> int:
+        return self.first_season + len(self) - 1
+
+    def positions(self, seasons) -> np.ndarray:
+        """Positions of seasons within the arrays of the index, with -1 for seasons outside of it."""
+        pos = np.asarray(seasons, dtype=np.int64) - self.first_season
+        return np.where((pos >= 0) & (pos < len(self)), pos, -1)
+
+    def lookup(self, season: int, column: str = "timestamp") -> Any:
+        """Value of column for a single season. """
+        pos = season - self.first_season
+        if not 0 <= pos < len(self):
+            raise KeyError(f"Season {season} is outside of the index ({self.first_season} - {self.last_season})")
+        return self.columns[column][pos]
+
+    def attach(
+        self,
+        df: pd.DataFrame,
+        columns: Optional[Union[List[str], Dict[str, str]]] = None,
+        season_col: str = "season",
+    ) -> pd.DataFrame:
+        """Returns a copy of df with the columns of the season of each row.
+
+        Equivalent to a left merge of df with the frame of the index on season_col (rows keep
+        their order, and rows of seasons outside of the index get null values), but the index of
+        df is preserved. columns (all columns by default) can map column names to new names.
+        """
+        if columns is None:
+            columns = list(self.columns)
+        if not isinstance(columns, dict):
+            columns = {col: col for col in columns}
+        pos = self.positions(df[season_col].to_numpy())
+        df = df.copy()
+        for col, name in columns.items():
+            # Missing values are filled with the null value of the column's dtype (upcasting ints)
+            df[name] = take(self.columns[col], pos, allow_fill=True)
+        return df
+
+    def attach_timestamps(self, df: pd.DataFrame, season_col: str = "season") -> pd.DataFrame:
+        """Returns a copy of df with the timestamp of the season of each row. """
+        return self.attach(df, ["timestamp"], season_col=season_col)
+
+    def frame(self, season_col: str = "season") -> pd.DataFrame:
+        return pd.DataFrame({
+            season_col: np.arange(self.first_season, self.last_season + 1),
+            **self.columns,
+        })
@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+
+# Reducers implemented natively by pandas groupby. "first" and "last" take the first and last
+# non-null value of each season, in order of the order column.
+SNAPSHOT_REDUCERS = ("first", "last", "sum", "min", "max", "mean")
+
+
+@dataclass(frozen=True)
+class SnapshotField:
+    name: str
+    reducer: str
+    precision: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class SnapshotAggregation:
+    """Declarative aggregation of daily snapshot entities into a single row per season.
+
+    The subgraph can have several snapshots for the same season (pauses in beanstalk), which are
+    collapsed by reducing each field with its reducer, after ordering snapshots by order_col.
+    The spec is validated when created, so a field can't silently be given two reducers.
+    """
+    fields: Tuple[SnapshotField, ...]
+    season_col: str = "season"
+    order_col: str = "timestamp"
+
+    def __post_init__(self):
+        names = [f.name for f in self.fields]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"Snapshot fields have multiple reducers: {duplicates}")
+        if self.season_col in names:
+            raise ValueError(f"Can't reduce the season column {self.season_col}")
+        unknown = {f.name: f.reducer for f in self.fields if f.reducer not in SNAPSHOT_REDUCERS}
+        if unknown:
+            raise ValueError(f"Unknown reducers {unknown}, expected one of {SNAPSHOT_REDUCERS}")
+
+    @property
+    def names(self) -> List[str]:
+        return [f.name for f in self.fields]
+
+    @property
+    def precisions(self) -> Dict[str, float]:
+        return {f.name: f.precision for f in self.fields if f.precision}
+
+    def aggs(self, columns: Iterable[str]) -> Dict[str, str]:
+        """Reducer of each of columns, in the order of the spec.
+
+        Raises if a column other than the season and order columns doesn't have a reducer.
+        """
+        columns = set(columns)
+        missing = columns - set(self.names) - {self.season_col, self.order_col}
+        if missing:
+            raise ValueError(f"Snapshot columns without a reducer: {sorted(missing)}")
+        return {f.name: f.reducer for f in self.fields if f.name in columns}
+
+    def aggregate(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Reduces df to a single row per season, sorted by season.
+
+        Snapshots are sorted once (queries are usually ordered already, in which case they
+        aren't sorted at all), and all fields are reduced in a single groupby.
+        """
+        aggs = self.aggs(df.columns)
+        if self.order_col in df.columns and not df[self.order_col].is_monotonic_increasing:
+            df = df.sort_values(self.order_col, kind="stable")
+        return df.groupby(self.season_col, sort=True).agg(aggs).reset_index()
@@ -1,6 +1,6 @@
 import json 
-from collections import Counter
 
+import numpy as np 
 import pandas as pd 
 
 
@@ -15,19 +15,23 @@ def validate_season_series(
     - Should be >1 for long form data. 
     - Should be 1 for wide form data. 
     """
-    szns = df[season_col_name]
+    szns = df[season_col_name].to_numpy()
+    if not len(szns): 
+        raise ValueError("Season axis incorrect\nSeries is empty\n")
     szn_min = szns.min()
     szn_max = szns.max()
-    counter = Counter(szns.values.tolist())
-    missing = []
-    wrong_count = []
-    for s in range(szn_min, szn_max): 
-        count = counter[s]
-        if count == 0: 
-            missing.append(s)
-        if count != count_expected and not (allow_missing and count == 0): 
-            wrong_count.append({"season": s, "count": count})
-    wrong_order = szns.values.tolist() != list(sorted(szns))
+    # Number of rows of each season in [szn_min, szn_max) 
+    counts = np.bincount(szns - szn_min, minlength=szn_max - szn_min + 1)[:-1]
+    szns_range = np.arange(szn_min, szn_max)
+    missing = szns_range[counts == 0].tolist()
+    is_wrong_count = counts != count_expected
+    if allow_missing: 
+        is_wrong_count &= counts != 0
+    wrong_count = [
+        {"season": s, "count": count} 
+        for s, count in zip(szns_range[is_wrong_count].tolist(), counts[is_wrong_count].tolist())
+    ]
+    wrong_order = bool((np.diff(szns) < 0).any())
     issues = []
     if wrong_order: 
         issues.append("Order of series is not monotonically increasing\n")
@@ -2,12 +2,21 @@ import os
 import re 
 from typing import Tuple, Dict, List
 
+import numpy as np
 from subgrounds.subgrounds import Subgrounds, Subgraph
-from pandas import DataFrame
+from pandas import DataFrame, Categorical
 from IPython.display import display 
 from IPython.core.display import HTML
 
 from .constants import ADDRS_SILO_TOKENS, DECIMALS_SILO_TOKENS
+from .cache import CachingSubgrounds
+from .pagination import install_pooled_client
+from .fixtures import install_recorder
+
+# Names and decimals of silo tokens, indexed by the category code of their address 
+_SILO_TOKEN_ADDRS = list(ADDRS_SILO_TOKENS.values())
+_SILO_TOKEN_NAMES = np.array(list(ADDRS_SILO_TOKENS.keys()), dtype=object)
+_SILO_TOKEN_DECIMALS = np.array([DECIMALS_SILO_TOKENS[name] for name in ADDRS_SILO_TOKENS])
 
 
 def camel_to_snake(name):
@@ -68,12 +77,17 @@ def remove_prefixes(df: DataFrame, prefixes: List[str]):
 def add_silo_token_name_adjust_precision(df, token_col, token_amount_cols, token_name_col="silo_token_name"):
     """Creates a column for silo token name by performing a lookup based on address. 
     Modifies the amount related field for each silo token by a token specific precision. 
+
+    Raises a ValueError listing the addresses that aren't silo tokens, if there are any. 
     """
-    token_names = dict_invert(ADDRS_SILO_TOKENS) 
-    df[token_name_col] = df[token_col].apply(lambda token_addr: token_names[token_addr]) 
-    for token_name in ADDRS_SILO_TOKENS:
-        row_mask = df[token_name_col] == token_name
-        df.loc[row_mask, token_amount_cols] = df.loc[row_mask, token_amount_cols] / DECIMALS_SILO_TOKENS[token_name]
+    # Codes index the lookup tables, with -1 for addresses that aren't silo tokens 
+    codes = Categorical(df[token_col], categories=_SILO_TOKEN_ADDRS).codes
+    unknown = codes == -1
+    if unknown.any(): 
+        counts = df.loc[unknown, token_col].value_counts(dropna=False)
+        raise ValueError(f"Unknown silo token addresses (with their number of rows): {counts.to_dict()}")
+    df[token_name_col] = _SILO_TOKEN_NAMES[codes]
+    df[token_amount_cols] = df[token_amount_cols].div(_SILO_TOKEN_DECIMALS[codes], axis=0)
 
 
 def ddf(df: DataFrame, **kwargs): 
@@ -87,9 +101,16 @@ def ddf(df: DataFrame, **kwargs):
 def load_subgraph(subgraph_host=None, subgraph_type=None) -> Tuple[Subgrounds, Subgraph]: 
     """Helper for initializing subgrounds and subgraph objects. 
     
+    Query results are served from the on disk frame cache when QUERY_DF_CACHE_DIR is set, 
+    and requests are sent over a shared pool of connections. Requests and responses are 
+    recorded as fixtures in SUBGRAPH_RECORD_DIR when it is set. 
+
     TODO: arg to select from different subgraph url's
     """
-    sg = Subgrounds()
+    install_pooled_client()
+    if os.environ.get("SUBGRAPH_RECORD_DIR"): 
+        install_recorder(os.environ["SUBGRAPH_RECORD_DIR"])
+    sg = CachingSubgrounds()
     bs: Subgraph = sg.load_subgraph(os.environ['SUBGRAPH_URL'])
     return sg, bs 
 
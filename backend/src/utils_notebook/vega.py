@@ -1,14 +1,13 @@
-import json
 import builtins 
-from functools import partial
 from typing import Optional, List 
 
 import altair as alt 
+import numpy as np 
 import pandas as pd 
 from palettable.tableau import Tableau_20
 from IPython.display import JSON, display, HTML 
-from deepdiff import DeepSearch
-from deepdiff.path import _path_to_elements
+
+from .downsampling import downsample_timeseries
 
 
 def condition_union(op_compare, op_join, values, key_var="variable"): 
@@ -73,75 +72,55 @@ def compute_width_paths(schema: dict):
     """Determine all paths through the schema to properties that determine chart width 
     
     These will be used by the frontend to perform dynamic width re-sizing.
-    """
-    # ----------------------------------------------------------------------------
-    # 1. Top level config 
-    # https://vega.github.io/vega-lite/docs/spec.html#config
-    
-    # 1.1. Match top level config "continuousWidth". Value is always a number.
-    m_view_cw = {
-        k: v for k, v in 
-        DeepSearch(schema, 'continuousWidth', verbose_level=2).get('matched_paths', {}).items() 
-        if k in set([
-            "root['config']['view']['continuousWidth']"
-        ])
-    }
-    
-    # 1.2. Match top level config "discreteWidth". Value is either number or object 
-    m_view_dw = {
-        k: v for k, v in 
-        DeepSearch(schema, 'discreteWidth', verbose_level=2).get('matched_paths', {}).items() 
-        if k in set([
-            "root['config']['view']['discreteWidth']", 
-            "root['config']['view']['discreteWidth']['step']",
-        ])
-    }
-    if len(m_view_dw) == 2: 
-        # One of the paths is a prefix of the other
-        m_view_dw.remove("root['config']['view']['discreteWidth']")
-        
-    # 1.3 Match top level config "step"  
-    m_view_step = {
-        k: v for k, v in 
-        DeepSearch(schema, 'step', verbose_level=2).get('matched_paths', {}).items() 
-        if k in set([
-            "root['config']['view']['step']"
-        ])
-    }
 
-    # ----------------------------------------------------------------------------
-    # 2. View level config 
-    
-    # 2.1. Match view level "width" mapping to a number  
-    m_w = {
-        k: v for k, v in 
-        DeepSearch(schema, 'width', verbose_level=2).get('matched_paths', {}).items() 
-        if k.endswith("['width']")
-    } 
-    
-    # 2.2. Match view level "width" mapping to an object  
-    m_w_step = {
-        k: v for k, v in 
-        DeepSearch(schema, 'step', verbose_level=2).get('matched_paths', {}).items()
-        if k.endswith("['width']['step']")
-    } 
-
-    # ----------------------------------------------------------------------------
-    # 3. Mark specific properties 
-
-    # 3.1. Radius properties for arc marks 
-    m_radius = {
-        **{
-            k: v for k, v in 
-            DeepSearch(schema, "innerRadius", verbose_level=2).get('matched_paths', {}).items()
-            if k.endswith("['innerRadius']")
-        }, 
-        **{
-            k: v for k, v in 
-            DeepSearch(schema, "outerRadius", verbose_level=2).get('matched_paths', {}).items()
-            if k.endswith("['outerRadius']")
-        }
-    } 
+    The schema is traversed once (depth first, in key order), skipping the inline datasets, 
+    which only hold data. Paths are grouped by the type of property they point to. 
+    """
+    # Paths of each type of property, in the order in which types are returned 
+    m_view_cw, m_view_dw, m_view_step, m_w, m_w_step, m_inner_radius, m_outer_radius = (
+        [] for _ in range(7)
+    )
+    stack = [
+        ([k], v) for k, v in reversed(list(schema.items())) if k != "datasets"
+    ]
+    while stack: 
+        path, value = stack.pop()
+        key = path[-1]
+        if isinstance(key, str): 
+            # ----------------------------------------------------------------------------
+            # 1. Top level config 
+            # https://vega.github.io/vega-lite/docs/spec.html#config
+            if len(path) == 3 and path[:2] == ["config", "view"]: 
+                # 1.1. "continuousWidth". Value is always a number.
+                if key == "continuousWidth": 
+                    m_view_cw.append((path, value))
+                # 1.2. "discreteWidth". Value is either number or object 
+                elif key == "discreteWidth" and not (isinstance(value, dict) and "step" in value): 
+                    m_view_dw.append((path, value))
+                # 1.3 "step"  
+                elif key == "step": 
+                    m_view_step.append((path, value))
+            elif path[:3] == ["config", "view", "discreteWidth"] and path[3:] == ["step"]: 
+                m_view_dw.append((path, value))
+            # ----------------------------------------------------------------------------
+            # 2. View level config 
+            # 2.1. "width" mapping to a number  
+            if key == "width": 
+                m_w.append((path, value))
+            # 2.2. "width" mapping to an object  
+            elif key == "step" and len(path) > 1 and path[-2] == "width": 
+                m_w_step.append((path, value))
+            # ----------------------------------------------------------------------------
+            # 3. Mark specific properties 
+            # 3.1. Radius properties for arc marks 
+            elif key == "innerRadius": 
+                m_inner_radius.append((path, value))
+            elif key == "outerRadius": 
+                m_outer_radius.append((path, value))
+        if isinstance(value, dict): 
+            stack.extend(([*path, k], v) for k, v in reversed(list(value.items())))
+        elif isinstance(value, list): 
+            stack.extend(([*path, i], v) for i, v in reversed(list(enumerate(value))))
 
     # ----------------------------------------------------------------------------
     # 4. Disallow certain types of autosize 
@@ -149,28 +128,19 @@ def compute_width_paths(schema: dict):
         raise ValueError("autosize fit not allowed")
     
     # ----------------------------------------------------------------------------
-    # 5. Combine all different path types together. Convert from string form 
-    #    to list of attribute accesses. 
+    # 5. Combine all different path types together. 
 
     wpaths = []
 
-    for wpath_key, wpath_value in {
-        **m_view_cw,
-        **m_view_dw,
-        **m_view_step,
-        **m_w,
-        **m_w_step,
-    }.items(): 
+    for wpath, wpath_value in [*m_view_cw, *m_view_dw, *m_view_step, *m_w, *m_w_step]: 
         # Properties that directly control width have no multiplier 
-        wpath = [list(e)[0] for e in _path_to_elements(wpath_key)]
-        wpaths.append({"path": wpath[1:], "factor": 1, "value": wpath_value})
+        wpaths.append({"path": wpath, "factor": 1, "value": wpath_value})
 
-    for wpath_key, wpath_value in m_radius.items(): 
+    for wpath, wpath_value in [*m_inner_radius, *m_outer_radius]: 
         # Properties that control the radius of marks for arc marks have a multiplier of .5 
         # This is because for every 1 pixel we want to decrease width, we should decrease 
         # the radius by .5 pixels. 
-        wpath = [list(e)[0] for e in _path_to_elements(wpath_key)]
-        wpaths.append({"path": wpath[1:], "factor": 3.33, "value": wpath_value})
+        wpaths.append({"path": wpath, "factor": 3.33, "value": wpath_value})
 
     return wpaths 
 
@@ -180,7 +150,8 @@ def output_chart(c: alt.Chart, css: Optional[str] = None):
     
     Can be used prior to displaying vega-lite charts for custom styling. 
     """
-    spec = json.loads(c.to_json())
+    # The dict that to_json would serialize, without a round trip through JSON 
+    spec = c.to_dict()
     return JSON({
         "spec": spec, 
         "width_paths": compute_width_paths(spec),
@@ -200,6 +171,27 @@ XAXIS_DEFAULTS = dict(
 )
 
 
+# Year and (1-based) month of the exploit, marked by a rule on timeseries charts. The day is either 
+# 16 or 17, see the exploit_day parameter of chart. 
+EXPLOIT_YEAR = 2022
+EXPLOIT_MONTH = 4
+
+
+def is_exploit_day(ts: pd.Series, exploit_day: int) -> pd.Series: 
+    """Whether each timestamp of ts is on the exploit day (same as exploit_day_expr). """
+    return (ts.dt.year == EXPLOIT_YEAR) & (ts.dt.month == EXPLOIT_MONTH) & (ts.dt.day == exploit_day)
+
+
+def exploit_day_expr(timestamp_col: str, exploit_day: int) -> str: 
+    """Vega expression testing whether the timestamp of a row is on the exploit day. """
+    # Months are 0-based in vega expressions 
+    return (
+        f"year(datum['{timestamp_col}']) === {EXPLOIT_YEAR} && "
+        f"month(datum['{timestamp_col}']) === {EXPLOIT_MONTH - 1} && "
+        f"date(datum['{timestamp_col}']) === {exploit_day}"
+    )
+
+
 def possibly_override(data = None, defaults = None, override = False):
     defaults = defaults or {}
     data = data or {} 
@@ -248,10 +240,22 @@ def chart(
     add_selection: bool = True, 
     return_selection: bool = False,     
     base_hook = None, 
+    fold: Optional[List[str]] = None, 
+    max_points: Optional[int] = None, 
+    downsample_method: str = "lttb", 
 ): 
     """Creates a chart with a shared time axis and up to two y axes 
         
-    Assumes that data is in long-wide format (i.e. df was processed with function wide_to_longwide)
+    Assumes that data is in long-wide format (i.e. df was processed with function wide_to_longwide), 
+    unless fold is specified. In that case df is in wide form and the columns in fold are folded 
+    into (variable, value) rows by vega, which keeps the other fields of each row, so the data 
+    is only turned into long-wide format on the client. This is equivalent to passing 
+    wide_to_longwide(df, timestamp_col, id_cols, fold) without fold, but the data in the spec 
+    is a fraction of the size, so only include the columns the chart needs in df. 
+
+    If max_points is specified, the series of each metric is downsampled to (at most) max_points 
+    points with downsample_method ("lttb" or "minmax"), before the data is added to the spec. 
+    The latest point and the points on the exploit day are always kept. 
     """
     rmetrics = rmetrics or []
     assert not set(lmetrics).intersection(set(rmetrics)), "Same metric on two axes"
@@ -267,6 +271,14 @@ def chart(
     l_yscales = l_yscales or {}
     r_yscales = r_yscales or {}
     legend_kwargs = legend_kwargs or dict(title=None)
+    assert exploit_day in [16, 17]
+    if max_points: 
+        ts = df[timestamp_col]
+        keep = is_exploit_day(ts, exploit_day) if pd.api.types.is_datetime64_any_dtype(ts) else None
+        df = downsample_timeseries(
+            df, timestamp_col, lmetrics + rmetrics, max_points, 
+            method=downsample_method, wide=bool(fold), keep=keep, 
+        )
     # Selection for nearest point. We either use an existing instance passed in by the user 
     # or create a new instance. Using an existing instance allows a selection to be shared 
     # across charts, which can be useful for creating interactions between linked views 
@@ -285,8 +297,11 @@ def chart(
     )
     
     
+    base = alt.Chart(df)
+    if fold: 
+        base = base.transform_fold(fold, as_=["variable", "value"])
     base = (
-        alt.Chart(df)
+        base
         .transform_calculate(stack_order=stack_order_expr("variable", metrics))
         .encode(x=alt.X(f"{timestamp_col}:O", axis=alt.Axis(**xaxis_kwargs)))
         .properties(title=title, width=width)
@@ -432,17 +447,12 @@ def chart(
         nearest = nearest.add_selection(selection_nearest)
     
 
-    assert exploit_day in [16, 17]
     rule_exploit = (
         # selection captures nearest timestamp (for current mouse position) 
         # tooltip rendered uses this data point (pivoted, so we have all data for this timestamp) 
         base
         .transform_pivot('variable', value='value', groupby=[timestamp_col])
-        .transform_filter(f"""
-            year(datum['{timestamp_col}']) === 2022 && 
-            month(datum['{timestamp_col}']) === 3 && 
-            date(datum['{timestamp_col}']) === {exploit_day} 
-        """) # && warn(datetime(datum['{timestamp_col}']))
+        .transform_filter(exploit_day_expr(timestamp_col, exploit_day))
         .mark_rule(opacity=1, color='#474440', strokeDash=[2.5,1])
     )
 
@@ -563,38 +573,39 @@ def chart_bin_count_value_aggregate(
     width: int = 400, 
     height: int = 200, 
 ): 
-    def classify(order, value):
-        for i in range(1, len(breakpoints)):
-            b0 = breakpoints[i-1] 
-            b1 = breakpoints[i]
-            if b0 <= value < b1: 
-                if order: 
-                    return i 
-                else: 
-                    if b1 == float('inf'): 
-                        return f"{string_pad_int(i)}.{int(b0):,}+ {value_field}"
-                    else: 
-                        return f"{string_pad_int(i)}.{int(b0):,} - {int(b1):,} {value_field}"
+    """Charts the number of addresses, and the sum of value_field over addresses, by bin. 
+
+    Addresses are binned by the sum of their value_field, with bin i covering the range 
+    [breakpoints[i-1], breakpoints[i]). Addresses outside of every bin are dropped. 
+    breakpoints must be in ascending order. 
+    """
+    breakpoints = np.asarray(breakpoints, dtype=float)
+    labels = [
+        f"{string_pad_int(i)}.{int(b0):,}+ {value_field}" 
+        if b1 == float('inf') else 
+        f"{string_pad_int(i)}.{int(b0):,} - {int(b1):,} {value_field}"
+        for i, (b0, b1) in enumerate(zip(breakpoints[:-1], breakpoints[1:]), start=1)
+    ]
             
     # pre-processing 
-    df = df.groupby(by="address").sum().reset_index()
-    df['class'] = df[value_field].apply(partial(classify, False))
+    # Addresses may be categorical (see dtypes.compact_dtypes), whose observed groups aren't sorted
+    df = df.groupby(by="address", observed=True)[[value_field]].sum().sort_index().reset_index()
+    # Index of the first breakpoint above each value, i.e. the (1-based) bin of the value. 
+    # NaN is sorted after inf, so it ends up outside of every bin. 
+    bins = np.searchsorted(breakpoints, df[value_field].to_numpy(dtype=float), side="right")
+    codes = np.where((bins >= 1) & (bins < len(breakpoints)), bins - 1, -1)
+    df['class'] = pd.Categorical.from_codes(codes, categories=labels)
     df = df.sort_values(value_field).reset_index(drop=True)
     df = df.dropna(subset="class")
     
-    # Get the count of pod holders by classification 
-    df_count_class = (
-        df[['class', value_field]]
-        .groupby('class').count()
-        .reset_index()
-        .rename(columns={value_field: "count"})
-    )
-    # Sum value held by each class of holders 
-    df_class_value = (
-        df[['class', value_field]]
-        .groupby('class').sum()
+    # Get the count of pod holders and the sum of value held by each class of holders 
+    df_class_agg = (
+        df.groupby('class', observed=True)[value_field]
+        .agg(["count", "sum"])
         .reset_index()
     )
+    df_count_class = df_class_agg[['class', 'count']]
+    df_class_value = df_class_agg[['class', 'sum']].rename(columns={"sum": value_field})
 
     color_domain = list(sorted(df_count_class['class'].unique()))
     color_range = [Tableau_20.hex_colors[i] for i in range(len(color_domain))]
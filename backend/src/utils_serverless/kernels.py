@@ -0,0 +1,254 @@
+import time 
+import queue 
+import atexit 
+import logging 
+import threading 
+from pathlib import Path 
+from contextlib import contextmanager
+from typing import List
+
+from jupyter_client import KernelManager
+
+logger = logging.getLogger(__name__)
+
+# Root of the serverless code bundle. Notebooks add this directory to sys.path 
+# themselves, but the pool needs it in place before the preload imports run. 
+PATH_CODE_ROOT = Path(__file__).parents[1].absolute()
+
+# Imports shared by (nearly) all production notebooks. Executing these when a 
+# kernel is started means that notebooks handed a pooled kernel find these 
+# modules already loaded in sys.modules. 
+PRELOAD_SRC = f"""
+import sys 
+if {str(PATH_CODE_ROOT)!r} not in sys.path: 
+    sys.path.append({str(PATH_CODE_ROOT)!r})
+
+import numpy 
+import pandas 
+import altair 
+import subgrounds 
+import utils_notebook.constants 
+import utils_notebook.css 
+import utils_notebook.pagination 
+import utils_notebook.queries 
+import utils_notebook.testing 
+import utils_notebook.utils 
+import utils_notebook.vega 
+"""
+
+# Clears all user defined names between executions, leaving imported modules loaded. 
+RESET_SRC = "get_ipython().run_line_magic('reset', '-f')"
+
+# Executed ahead of the cells of a notebook, so that each of them is profiled (see CellProfiler). 
+CELL_PROFILER_SETUP_SRC = f"""
+import sys as _sys 
+if {str(PATH_CODE_ROOT)!r} not in _sys.path: 
+    _sys.path.append({str(PATH_CODE_ROOT)!r})
+from utils_serverless.profiling import CellProfiler as _CellProfiler 
+_CellProfiler.install_ipython(get_ipython())
+del _sys, _CellProfiler 
+"""
+
+# Executed after the cells of a notebook, outputting the profile of each cell as JSON. 
+CELL_PROFILER_OUTPUT_SRC = """
+from IPython.display import JSON as _JSON 
+_JSON(get_ipython()._cell_profiler.cells)
+"""
+
+
+class KernelError(RuntimeError): 
+    pass 
+
+
+class PooledKernel: 
+    """A running kernel with preloaded imports, along with a client used to manage it. 
+    
+    The client held here is only used by the pool (preload, reset, health checks). 
+    Notebook executions create their own clients from the kernel manager. 
+    """
+
+    def __init__(self, cwd: str, preload_src: str, timeout: int): 
+        self.timeout = timeout 
+        self.uses = 0 
+        start_time = time.time()
+        self.km = KernelManager(
+            kernel_name='python3', 
+            # nbclient requires an async client when executing notebooks 
+            client_class='jupyter_client.asynchronous.AsyncKernelClient',
+        )
+        self.km.start_kernel(cwd=cwd)
+        self.kc = self.km.blocking_client()
+        self.kc.start_channels()
+        try: 
+            self.kc.wait_for_ready(timeout=timeout)
+            self.run(preload_src)
+        except BaseException: 
+            self.shutdown()
+            raise 
+        self.start_seconds = time.time() - start_time
+
+    def run(self, src: str) -> None: 
+        """Executes source code within the kernel, raising if execution did not succeed."""
+        reply = self.kc.execute_interactive(
+            src, 
+            silent=True, 
+            store_history=False, 
+            timeout=self.timeout, 
+            output_hook=lambda msg: None, 
+        )
+        if reply['content']['status'] != 'ok': 
+            raise KernelError(
+                f"Kernel execution failed: {reply['content'].get('ename')} {reply['content'].get('evalue')}"
+            )
+
+    def is_healthy(self) -> bool: 
+        try: 
+            if not self.km.is_alive(): 
+                return False 
+            self.run("pass")
+            return True 
+        except Exception: 
+            return False 
+
+    def reset(self) -> None: 
+        self.run(RESET_SRC)
+
+    def shutdown(self) -> None: 
+        try: 
+            self.kc.stop_channels()
+            self.km.shutdown_kernel(now=True)
+        except Exception as e: 
+            logger.warning(f"Failed to cleanly shutdown kernel: {e}")
+
+
+class KernelPool: 
+    """Pool of pre-started kernels handed out one notebook execution at a time. 
+    
+    Kernels are reset (user namespace cleared) after each execution and replaced 
+    after max_uses executions. Kernels that fail a reset or health check are evicted 
+    and replaced by new kernels the next time one is requested. 
+    """
+
+    def __init__(
+        self, 
+        size: int, 
+        cwd: str, 
+        max_uses: int = 10, 
+        preload_src: str = PRELOAD_SRC, 
+        timeout: int = 60, 
+    ): 
+        assert size > 0, "Kernel pool must contain at least one kernel"
+        self.size = size 
+        self.cwd = cwd 
+        self.max_uses = max_uses 
+        self.preload_src = preload_src 
+        self.timeout = timeout 
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._num_kernels = 0 
+        self._closed = False 
+        atexit.register(self.shutdown)
+
+    def _start_kernel(self) -> PooledKernel: 
+        kernel = PooledKernel(self.cwd, self.preload_src, self.timeout)
+        logger.info(f"Started pooled kernel in {kernel.start_seconds} seconds.")
+        return kernel 
+
+    def warm(self) -> None: 
+        """Starts kernels until the pool is full."""
+        while True: 
+            with self._lock: 
+                if self._num_kernels >= self.size: 
+                    return 
+                self._num_kernels += 1 
+            try: 
+                self._idle.put(self._start_kernel())
+            except BaseException: 
+                with self._lock: 
+                    self._num_kernels -= 1 
+                raise 
+
+    def _acquire(self) -> PooledKernel: 
+        while True: 
+            try: 
+                kernel = self._idle.get_nowait()
+            except queue.Empty: 
+                with self._lock: 
+                    start_new = self._num_kernels < self.size 
+                    if start_new: 
+                        self._num_kernels += 1 
+                if start_new: 
+                    try: 
+                        return self._start_kernel()
+                    except BaseException: 
+                        self._evicted()
+                        raise 
+                try: 
+                    # Wait for a kernel to be released. Times out periodically so that 
+                    # capacity freed up by evicted kernels is noticed. 
+                    kernel = self._idle.get(timeout=1)
+                except queue.Empty: 
+                    continue 
+            if kernel.is_healthy(): 
+                return kernel 
+            logger.warning("Evicting unhealthy kernel from pool.")
+            kernel.shutdown()
+            self._evicted()
+
+    def _release(self, kernel: PooledKernel) -> None: 
+        kernel.uses += 1 
+        if kernel.uses >= self.max_uses: 
+            logger.info(f"Recycling pooled kernel after {kernel.uses} uses.")
+            kernel.shutdown()
+            self._evicted()
+            self._replenish()
+            return 
+        try: 
+            kernel.reset()
+        except Exception as e: 
+            logger.warning(f"Evicting kernel from pool, reset failed: {e}")
+            kernel.shutdown()
+            self._evicted()
+            self._replenish()
+            return 
+        self._idle.put(kernel)
+
+    def _replenish(self) -> None: 
+        """Starts replacement kernels in the background so that the pool stays warm."""
+        def warm(): 
+            try: 
+                self.warm()
+            except Exception as e: 
+                logger.warning(f"Failed to replenish kernel pool: {e}")
+        if not self._closed: 
+            threading.Thread(target=warm, daemon=True).start()
+
+    def _evicted(self) -> None: 
+        with self._lock: 
+            self._num_kernels -= 1 
+
+    @contextmanager
+    def kernel(self): 
+        """Checks out a kernel for the duration of a single notebook execution. 
+        
+        Yields the kernel manager, which should be passed on to the notebook client. 
+        """
+        if self._closed: 
+            raise KernelError("Kernel pool has been shut down.")
+        kernel = self._acquire()
+        try: 
+            yield kernel.km 
+        finally: 
+            self._release(kernel)
+
+    def shutdown(self) -> None: 
+        self._closed = True 
+        kernels: List[PooledKernel] = []
+        while True: 
+            try: 
+                kernels.append(self._idle.get_nowait())
+            except queue.Empty: 
+                break 
+        for kernel in kernels: 
+            kernel.shutdown()
+            self._evicted()
@@ -0,0 +1,104 @@
+import os
+import time
+import resource
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def process_peak_rss_mb() -> float:
+    """High water mark of the resident memory of this process since it started, in MB."""
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident memory of this process in MB, or None if it can't be read (not linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class CellProfiler:
+    """Records the wall time, CPU time and memory of each cell of a notebook execution.
+
+    Memory of a cell is reported as:
+
+    - rss_delta_mb: The change of the resident memory of the process over the cell.
+    - alloc_peak_mb: The peak of the memory allocated by python during the cell, relative to
+      the start of the cell. Only recorded while tracemalloc is tracing (e.g. with
+      PYTHONTRACEMALLOC=1), as tracing slows down allocations. None otherwise.
+    - process_peak_rss_mb: The high water mark of the process at the end of the cell. It never
+      decreases, and includes everything the process ran before (e.g. previous notebooks
+      executed by a pooled kernel), so it isn't specific to the cell.
+
+    All three are measured for the whole process, so they are only attributable to a cell when
+    notebooks are executed one at a time (as in kernels), and not when notebooks are executed
+    concurrently in threads of the same process.
+    """
+
+    def __init__(self, cpu_clock: Callable[[], float] = time.thread_time):
+        # Defaults to the CPU time of the executing thread, as in-process executions share
+        # the process with other notebooks.
+        self.cpu_clock = cpu_clock
+        self.cells: List[Dict] = []
+        self._current: Optional[Tuple[int, str, float, float, Optional[float], int]] = None
+
+    @staticmethod
+    def label(src: str) -> str:
+        """Short description of a cell, i.e. its first non-empty line."""
+        lines = [l.strip() for l in src.splitlines() if l.strip()]
+        return lines[0][:80] if lines else ""
+
+    def start_cell(self, index: int, label: str = "") -> None:
+        """Starts timing a cell, ending the current cell if there is one."""
+        self.end_cell()
+        traced = 0
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            traced, _ = tracemalloc.get_traced_memory()
+        self._current = (index, label, time.perf_counter(), self.cpu_clock(), rss_mb(), traced)
+
+    def end_cell(self) -> None:
+        if self._current is None:
+            return
+        index, label, start_wall, start_cpu, start_rss, start_traced = self._current
+        end_rss = rss_mb()
+        alloc_peak_mb = None
+        if tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            alloc_peak_mb = max(peak - start_traced, 0) / 2**20
+        self.cells.append({
+            "cell": index,
+            "label": label,
+            "wall_seconds": time.perf_counter() - start_wall,
+            "cpu_seconds": self.cpu_clock() - start_cpu,
+            "rss_delta_mb": None if start_rss is None or end_rss is None else end_rss - start_rss,
+            "alloc_peak_mb": alloc_peak_mb,
+            "process_peak_rss_mb": process_peak_rss_mb(),
+        })
+        self._current = None
+
+    @classmethod
+    def install_ipython(cls, ip) -> "CellProfiler":
+        """Profiles all cells subsequently executed by an IPython shell (e.g. a kernel).
+
+        The profiler is stored on the shell, as it outlives the user namespace of pooled
+        kernels. Replaces any profiler installed previously.
+        """
+        previous = getattr(ip, "_cell_profiler", None)
+        if previous is not None:
+            ip.events.unregister("pre_run_cell", previous._pre_run_cell)
+            ip.events.unregister("post_run_cell", previous._post_run_cell)
+        # A kernel executes a single notebook at a time, using all of its threads
+        profiler = ip._cell_profiler = cls(cpu_clock=time.process_time)
+        ip.events.register("pre_run_cell", profiler._pre_run_cell)
+        ip.events.register("post_run_cell", profiler._post_run_cell)
+        return profiler
+
+    def _pre_run_cell(self, info) -> None:
+        self.start_cell(len(self.cells), self.label(info.raw_cell))
+
+    def _post_run_cell(self, result) -> None:
+        self.end_cell()
@@ -0,0 +1,203 @@
+import re
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import orjson
+import numpy as np
+import pandas as pd
+
+
+# d3-format specifier: [[fill]align][sign][symbol][0][width][,][.precision][~][type]
+RE_D3_FORMAT = re.compile(
+    r"^(?:.?[<>=^])?[-+( ]?[$#]?0?\d*,?(?:\.(?P<precision>\d+))?~?(?P<type>[eEfgGrsp%bodxXcn])?$"
+)
+# Precision used by d3-format when the specifier doesn't have one
+D3_FORMAT_PRECISION_DEFAULT = 6
+# Fields of data objects referenced by vega expressions, e.g. datum.value or datum['value']
+RE_DATUM_FIELD = re.compile(r"""datum(?:\.(\w+)|\[\s*['"]([^'"]+)['"]\s*\])""")
+# Properties of a vega-lite spec holding expressions evaluated on data objects
+EXPRESSION_KEYS = ("calculate", "filter", "test", "expr")
+# Encoding channels displaying the values of their field as text
+TEXT_CHANNELS = ("text", "tooltip")
+
+
+def _default(obj):
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """Serializes obj as compact JSON, in a single pass.
+
+    Unlike json.dumps, numpy scalars and arrays, as well as pandas timestamps, are serialized
+    natively, and NaN is serialized as null (rather than as the invalid JSON token NaN).
+    """
+    return orjson.dumps(
+        obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def _decimals_significant(significant_digits: int) -> Callable[[np.ndarray], np.ndarray]:
+    def decimals(magnitudes: np.ndarray) -> np.ndarray:
+        return significant_digits - 1 - magnitudes
+    return decimals
+
+
+def _decimals_fixed(decimals: int) -> Callable[[np.ndarray], np.ndarray]:
+    return lambda magnitudes: np.full_like(magnitudes, decimals)
+
+
+def format_decimals(fmt: str) -> Optional[Callable[[np.ndarray], np.ndarray]]:
+    """Returns the decimals of values displayed with d3-format specifier fmt, as a function of
+    the order of magnitude of the values. Returns None if the number of decimals isn't bounded
+    by fmt (i.e. values are displayed in full), or if fmt can't be parsed.
+    """
+    match = RE_D3_FORMAT.match(fmt)
+    if match is None:
+        return None
+    precision = match.group("precision")
+    precision = int(precision) if precision is not None else None
+    match match.group("type"):
+        case "f":
+            return _decimals_fixed(D3_FORMAT_PRECISION_DEFAULT if precision is None else precision)
+        case "%":
+            return _decimals_fixed((D3_FORMAT_PRECISION_DEFAULT if precision is None else precision) + 2)
+        case "d" | "b" | "o" | "x" | "X" | "c":
+            return _decimals_fixed(0)
+        case "e" | "E":
+            # Precision is the number of digits after the decimal point of the mantissa
+            return _decimals_significant(
+                (D3_FORMAT_PRECISION_DEFAULT if precision is None else precision) + 1
+            )
+        case "g" | "G" | "r" | "s" | "p" | "n" | None:
+            if precision is None:
+                # Formats without a type use the shortest representation of the value
+                return None if match.group("type") is None else _decimals_significant(
+                    D3_FORMAT_PRECISION_DEFAULT
+                )
+            return _decimals_significant(max(1, precision))
+    return None
+
+
+def field_formats(spec) -> Tuple[Dict[str, List[str]], Set[str]]:
+    """Returns the formats of the quantitative fields of a vega-lite spec (including the formats
+    of their axes and legends), by field name, and the fields whose values may be displayed in full.
+
+    A field is displayed in full when it is referenced by an expression (e.g. a calculate
+    transform formatting it with format(datum.value, ',d')), or when it is shown as text or in a
+    tooltip without a number format. Fields folded or pivoted by a transform are displayed through
+    the fields derived from them, so they also get the formats of those fields.
+    """
+    formats = defaultdict(list)
+    exact, declared = set(), set()
+    folds, pivots = [], []
+    stack = [(None, spec)]
+    while stack:
+        key, obj = stack.pop()
+        if isinstance(obj, dict):
+            match obj:
+                case {"field": str(field)}:
+                    quantitative = obj.get("type") == "quantitative"
+                    if quantitative:
+                        formats[field].extend(
+                            d["format"] for d in (obj, obj.get("axis"), obj.get("legend"))
+                            if isinstance(d, dict) and isinstance(d.get("format"), str)
+                            and d.get("formatType", "number") == "number"
+                        )
+                    if key in TEXT_CHANNELS and not (
+                        quantitative and isinstance(obj.get("format"), str)
+                        and obj.get("formatType", "number") == "number"
+                    ):
+                        exact.add(field)
+                case {"fold": list(fields)}:
+                    folds.append((fields, obj.get("as") or ["key", "value"]))
+                case {"pivot": str(), "value": str(value)}:
+                    pivots.append(value)
+            for k, v in obj.items():
+                if k in EXPRESSION_KEYS and isinstance(v, str):
+                    exact.update(a or b for a, b in RE_DATUM_FIELD.findall(v))
+            match obj.get("as"):
+                case str(name):
+                    declared.add(name)
+                case list(names):
+                    declared.update(name for name in names if isinstance(name, str))
+            stack.extend(obj.items())
+        elif isinstance(obj, list):
+            # Items of lists (e.g. tooltips, layers) are in the context of the list's key
+            stack.extend((key, v) for v in obj)
+    # The names of pivoted fields are data, so pivoted values get every format of the spec, and
+    # are displayed in full if any field that is neither a column of the datasets nor declared
+    # by a transform (i.e. possibly a pivoted field) is.
+    columns = {k for rows in spec.get("datasets", {}).values() for row in rows[:1] for k in row}
+    formats_all = [fmt for fmts in formats.values() for fmt in fmts]
+    for value in pivots:
+        formats[value].extend(formats_all)
+        if exact - columns - declared:
+            exact.add(value)
+    for fields, (_, value) in folds:
+        for field in fields:
+            formats[field].extend(formats[value])
+            if value in exact:
+                exact.add(field)
+    return formats, exact
+
+
+def quantize(values: np.ndarray, decimals_fns: List[Callable[[np.ndarray], np.ndarray]]) -> np.ndarray:
+    """Rounds each value to the largest number of decimals returned by decimals_fns. """
+    finite = np.isfinite(values) & (values != 0)
+    magnitudes = np.zeros(len(values), dtype=int)
+    magnitudes[finite] = np.floor(np.log10(np.abs(values[finite]))).astype(int)
+    decimals = np.max([fn(magnitudes) for fn in decimals_fns], axis=0)
+    # Dividing by (rather than multiplying with) exact powers of ten gives the float closest
+    # to the rounded decimal value, which is what json encodes as the shortest representation.
+    with np.errstate(invalid="ignore", over="ignore"):
+        pos = np.maximum(decimals, 0)
+        neg = np.maximum(-decimals, 0)
+        rounded = np.where(
+            decimals >= 0,
+            np.round(values * 10.0 ** pos) / 10.0 ** pos,
+            np.round(values / 10.0 ** neg) * 10.0 ** neg,
+        )
+    # Keeps values that can't be rounded (e.g. 1e308 * 10 ** pos overflows) as they are
+    return np.where(np.isfinite(rounded), rounded, values)
+
+
+def quantize_spec(spec: dict, significant_digits: int) -> dict:
+    """Rounds the floats of the inline datasets of a vega-lite spec, in place.
+
+    Each value keeps at least significant_digits significant digits, which is enough for it
+    to be drawn at the same position, and all the digits displayed by the formats of its field
+    (e.g. tooltips), so the text shown on the chart doesn't change. Only fields with known formats
+    are rounded: fields without a format, or that may be displayed in full (see field_formats),
+    are left as they are. Rounding such fields could change the text of the chart, as well as
+    the order of sorted values.
+    """
+    formats, exact = field_formats(spec)
+    decimals_significant = _decimals_significant(significant_digits)
+    for rows in spec.get("datasets", {}).values():
+        columns = defaultdict(list)
+        for i, row in enumerate(rows):
+            if not isinstance(row, dict):
+                continue
+            for k, v in row.items():
+                if type(v) is float:
+                    columns[k].append(i)
+        for k, row_indices in columns.items():
+            if k in exact or not formats.get(k):
+                continue
+            decimals_fns = [decimals_significant]
+            for fmt in formats[k]:
+                fn = format_decimals(fmt)
+                if fn is None:
+                    break
+                decimals_fns.append(fn)
+            else:
+                values = np.array([rows[i][k] for i in row_indices], dtype=float)
+                for i, v in zip(row_indices, quantize(values, decimals_fns).tolist()):
+                    rows[i][k] = v
+    return spec
@@ -1,17 +1,25 @@
 import os
+import hashlib 
 import logging 
 import time 
 import datetime 
+import threading 
+import importlib.util
 from functools import wraps
-from typing import Dict, Tuple, List
+from typing import Any, Dict, Tuple, List, Optional, Union
 from pathlib import Path 
 
 import nbformat
+from nbformat.v4 import new_code_cell
 from nbclient import NotebookClient
 from google.api_core.exceptions import NotFound
 from google.cloud import storage 
 import google.auth 
 
+from .kernels import KernelPool, CELL_PROFILER_SETUP_SRC, CELL_PROFILER_OUTPUT_SRC
+from .profiling import CellProfiler
+from .serialization import dumps
+
 logger = logging.getLogger(__name__)
 
 from google.cloud.storage._helpers import _get_storage_host
@@ -19,7 +27,7 @@ logger.info(f"Storage host: {_get_storage_host()}")
 
 
 def log_runtime_decorator(log_func=None): 
-    """Logs runtime of wrapped function. Also stores runtime as private attribute on function.
+    """Logs runtime of wrapped function. 
     
     Necessary? No. Cool? Yes.
     """
@@ -30,7 +38,6 @@ def log_runtime_decorator(log_func=None):
             rval = fn(*args, **kwargs)
             end_time = time.time()
             run_secs = end_time - start_time 
-            decorator_inception_lmao_lmao._decorated_run_time_seconds = run_secs
             msg = (log_func and log_func(run_secs, args, kwargs)) or fn.__name__
             logger.info(msg)
             return rval 
@@ -38,12 +45,43 @@ def log_runtime_decorator(log_func=None):
     return decorator_inception_lmao
 
 
+def replace_named_data(spec: Any, urls: Dict[str, str]) -> Any: 
+    """Replaces references to named datasets (e.g. {"name": "data-123"}) in a vega-lite spec 
+    with references to the urls of the datasets. 
+    """
+    match spec: 
+        case {"data": {"name": str(name)}} if name in urls: 
+            return {
+                **{k: replace_named_data(v, urls) for k, v in spec.items() if k != "data"}, 
+                "data": {"url": urls[name], "format": {"type": "json"}}, 
+            }
+        case dict(): 
+            return {k: replace_named_data(v, urls) for k, v in spec.items()}
+        case list(): 
+            return [replace_named_data(v, urls) for v in spec]
+    return spec 
+
+
 class StorageClient: 
 
+    # Datasets are named by their content, so they never change once uploaded 
+    DATASET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+    # Datasets are deleted by the lifecycle rule of the bucket (lifecycle.json) once their custom 
+    # time is older than its retention. The custom time of a dataset is set to the current time 
+    # whenever a spec references it, at most once per interval, which must be far shorter than the 
+    # retention so that referenced datasets are never deleted. 
+    DATASET_TOUCH_INTERVAL = datetime.timedelta(days=1)
+
     def __init__(self) -> None:
         credentials, project_id = google.auth.load_credentials_from_file(os.environ['GOOGLE_APPLICATION_CREDENTIALS'])
         self.client = storage.Client(project=project_id, credentials=credentials)
         self.bucket = self.client.bucket(os.environ["NEXT_PUBLIC_STORAGE_BUCKET_NAME"])
+        # Custom times of the datasets known to exist in the bucket, by name 
+        self._datasets: Dict[str, datetime.datetime] = {}
+        self._datasets_lock = threading.Lock()
+
+    def public_url(self, name: str) -> str: 
+        return f"{_get_storage_host()}/{self.bucket.name}/{name}"
 
     def get_blob(self, name: str, cur_dtime: datetime.datetime): 
         blob = self.bucket.blob(name)
@@ -63,10 +101,52 @@ class StorageClient:
             f"Upload {args[1].name} to GCP storage bucket took {run_secs} seconds."
         )
     )
-    def upload(self, blob, data: str) -> None: 
-        blob.upload_from_string(data, retry=None)
+    def upload(self, blob, data: Union[str, bytes]) -> None: 
+        blob.upload_from_string(data, content_type="application/json", retry=None)
         return 
 
+    def upload_datasets(self, spec: dict) -> dict: 
+        """Moves the inline datasets of a vega-lite spec into their own blobs. 
+
+        Each dataset is stored as datasets/<content hash>.json, so a dataset is only uploaded 
+        if its content changed (or it wasn't uploaded before), and datasets with the same 
+        content are stored once. Datasets that already exist have their custom time renewed 
+        (see DATASET_TOUCH_INTERVAL). Returns the spec, with datasets referenced by url. 
+        """
+        urls = {}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for name, values in spec.get("datasets", {}).items(): 
+            data = dumps(values)
+            blob_name = f"datasets/{hashlib.sha256(data).hexdigest()}.json"
+            with self._datasets_lock: 
+                custom_time = self._datasets.get(blob_name)
+            if custom_time is None or now - custom_time >= self.DATASET_TOUCH_INTERVAL: 
+                custom_time = self._touch_dataset(blob_name, data, now)
+                with self._datasets_lock: 
+                    self._datasets[blob_name] = custom_time
+            urls[name] = self.public_url(blob_name)
+        return replace_named_data(
+            {k: v for k, v in spec.items() if k != "datasets"}, urls
+        )
+
+    def _touch_dataset(self, name: str, data: bytes, now: datetime.datetime) -> datetime.datetime: 
+        """Uploads a dataset if it doesn't exist, or renews its custom time if it is older than 
+        DATASET_TOUCH_INTERVAL. Returns the custom time of the dataset. 
+        """
+        blob = self.bucket.blob(name)
+        try: 
+            blob.reload()
+        except NotFound: 
+            blob.cache_control = self.DATASET_CACHE_CONTROL 
+            blob.custom_time = now 
+            self.upload(blob, data)
+            return now 
+        if blob.custom_time is None or now - blob.custom_time >= self.DATASET_TOUCH_INTERVAL: 
+            blob.custom_time = now 
+            blob.patch(retry=None)
+            return now 
+        return blob.custom_time 
+
 
 class NotebookRunner: 
 
@@ -78,6 +158,29 @@ class NotebookRunner:
             for nb_path in self.path_notebooks.iterdir() 
             if nb_path.suffix == '.ipynb'
         }
+        # Execution mode. 
+        # - "kernel": Notebooks are executed within a jupyter kernel. 
+        # - "module": Notebooks are executed in-process, by calling the modules generated 
+        #   from each notebook when building the serverless code bundle. Falls back to 
+        #   "kernel" for notebooks without a generated module. 
+        self.mode = os.environ.get("NOTEBOOK_RUNNER_MODE", "kernel")
+        if self.mode not in ["kernel", "module"]: 
+            raise ValueError(f"Invalid notebook runner mode {self.mode}")
+        self._modules = {}
+        self._modules_lock = threading.Lock()
+        # Pool of warm kernels shared by executions. When the pool size is 0, 
+        # each execution starts (and shuts down) its own kernel. 
+        kernel_pool_size = int(os.environ.get("KERNEL_POOL_SIZE", 0))
+        self.kernel_pool: Optional[KernelPool] = None 
+        if kernel_pool_size: 
+            self.kernel_pool = KernelPool(
+                size=kernel_pool_size, 
+                cwd=str(self.path_notebooks.absolute()), 
+                max_uses=int(os.environ.get("KERNEL_POOL_MAX_USES", 10)), 
+            )
+            if self.mode == "kernel": 
+                # Kernels are only needed as a fallback in module mode, so start them lazily 
+                self.kernel_pool.warm()
 
     @property
     def names(self) -> List[str]: 
@@ -86,6 +189,34 @@ class NotebookRunner:
     def exists(self, nb_name: str) -> bool: 
         return nb_name in self.ntbk_name_path_map 
 
+    def _load_module(self, nb_name: str): 
+        """Loads the module generated from a notebook, returning None if it doesn't exist."""
+        with self._modules_lock: 
+            if nb_name not in self._modules: 
+                module_path: Path = self.ntbk_name_path_map[nb_name].with_suffix(".py")
+                module = None 
+                if module_path.exists(): 
+                    spec = importlib.util.spec_from_file_location(f"notebooks_compiled.{nb_name}", module_path)
+                    module = importlib.util.module_from_spec(spec)
+                    spec.loader.exec_module(module)
+                self._modules[nb_name] = module 
+            return self._modules[nb_name]
+
+    def _execute_notebook(self, nb_node, km=None): 
+        nb_client = NotebookClient(
+            nb_node, 
+            km=km, 
+            timeout=600, 
+            kernel_name='python3', 
+            resources={'metadata': {'path': str(self.path_notebooks)}}
+        )
+        try: 
+            return nb_client.execute()
+        finally: 
+            if km is not None and nb_client.kc is not None: 
+                # The client doesn't clean up after itself when it doesn't own the kernel 
+                nb_client.kc.stop_channels()
+
     @log_runtime_decorator(
         log_func=lambda run_secs, args, _: (
             f"Executing notebook {args[1]} took {run_secs} seconds."
@@ -97,18 +228,31 @@ class NotebookRunner:
             Args: 
                 nb_name: The key for the notebook. 
             Returns: 
-                nb_output_json: The data output of the notebook. 
+                nb_output_json: The data output of the notebook, along with the wall time, 
+                    CPU time and memory of each of its cells (cell_profile, see CellProfiler). 
         """
+        if self.mode == "module" and (module := self._load_module(nb_name)): 
+            profiler = CellProfiler()
+            try: 
+                output = module.run(profiler)
+            finally: 
+                profiler.end_cell()
+            match output: 
+                case {"spec": _, "width_paths": _, "css": _} as nb_output_json: 
+                    return {**nb_output_json, "cell_profile": profiler.cells}
+            raise ValueError("Notebook module executed but output form was incorrect.")
+
         nb_path: Path = self.ntbk_name_path_map[nb_name]
         nb_node = nbformat.read(str(nb_path), as_version=4)
-        nb_client = NotebookClient(
-            nb_node, 
-            timeout=600, 
-            kernel_name='python3', 
-            resources={'metadata': {'path': str(self.path_notebooks)}}
-        )
+        # Cells profiling the cells of the notebook, within the kernel 
+        nb_node.cells.insert(0, new_code_cell(CELL_PROFILER_SETUP_SRC))
+        nb_node.cells.append(new_code_cell(CELL_PROFILER_OUTPUT_SRC))
         # nb is a dict with structure defined here: https://nbformat.readthedocs.io/en/latest/format_description.html
-        nb = nb_client.execute()
+        if self.kernel_pool: 
+            with self.kernel_pool.kernel() as km: 
+                nb = self._execute_notebook(nb_node, km=km)
+        else: 
+            nb = self._execute_notebook(nb_node)
         match nb: 
             case {
                 "cells": [
@@ -121,9 +265,17 @@ class NotebookRunner:
                                 "data": {"application/json": nb_output_json}
                             }
                         ]
+                    }, 
+                    {
+                        "outputs": [
+                            {
+                                "output_type": "execute_result",
+                                "data": {"application/json": list(cell_profile)}
+                            }
+                        ]
                     }
                 ]
             }:
-                return nb_output_json 
+                return {**nb_output_json, "cell_profile": cell_profile} 
                 
         raise ValueError("Notebook executed but output form was incorrect.")
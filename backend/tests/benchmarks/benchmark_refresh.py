@@ -0,0 +1,330 @@
+"""End-to-end benchmark of chart refreshes, with the runtime of each notebook split into phases.
+
+Runs handler_charts_refresh for every prod notebook against the storage emulator and the local
+subgraph stand-in (serving fixtures recorded with `make subgraph-record`), so results don't
+depend on the network or on the state of the subgraph. Query caches are disabled so that every
+run fetches (and transforms) all of its data.
+
+The time spent refreshing a notebook is attributed to the innermost phase being executed:
+
+- kernel_start: Starting jupyter kernels (kernel mode only).
+- imports: Loading the module generated from the notebook. The dependencies of notebooks (the
+  imports preloaded by kernels, see utils_serverless.kernels.PRELOAD_SRC) are imported once
+  before refreshing and reported separately as import_seconds, so the import statements of
+  notebooks are mostly lookups in sys.modules, counted within transforms.
+- fetch: Subgraph requests and the conversion of responses into dataframes.
+- transforms: Everything else the notebook does, i.e. mostly pandas transforms. In kernel mode
+  this is the whole notebook execution, as phases within the kernel can't be timed from here.
+- spec_build: Building the vega-lite spec from the altair chart.
+- width_paths: compute_width_paths.
+- serialize: Rounding chart data (quantize_spec) and the JSON serialization of the objects uploaded
+  to storage.
+- upload: Uploading to storage.
+- other: Anything outside of the phases above (e.g. reading blob metadata).
+
+Results are written as JSON and compared against a baseline (a previous result, by default
+baseline_refresh.json next to this script), reporting phases that got slower by more than the
+tolerance. The exit code is 1 when there are regressions, or when there is no baseline to compare
+against (run with --write-baseline to store the results as the baseline instead).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import datetime
+import threading
+import statistics
+from pathlib import Path
+from functools import wraps
+from types import SimpleNamespace
+from collections import defaultdict
+from contextlib import contextmanager, ExitStack
+from unittest import mock
+from typing import Dict, List, Optional
+
+PATH_TESTS = Path(__file__).parents[1]
+sys.path.append(str(PATH_TESTS))
+sys.path.insert(0, os.environ.get("PATH_SERVERLESS_CODE_DEPLOY", str(PATH_TESTS.parent / "src")))
+
+PHASES = [
+    "kernel_start", "imports", "fetch", "transforms", "spec_build",
+    "width_paths", "serialize", "upload", "other",
+]
+PATH_BASELINE_DEFAULT = Path(__file__).parent / "baseline_refresh.json"
+
+
+class PhaseTimer:
+    """Attributes the wall clock time of tracked threads to the innermost phase being executed.
+
+    Only threads within `track` are timed, which excludes the worker threads used to paginate
+    queries concurrently (the tracked thread is waiting on them within the fetch phase anyway).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.runs: Dict[str, List[Dict[str, float]]] = defaultdict(list)
+
+    def _switch(self, stack: List[str], phase: Optional[str]) -> None:
+        now = time.perf_counter()
+        totals = self._local.totals
+        totals[stack[-1]] += now - self._local.t0
+        self._local.t0 = now
+        if phase is None:
+            stack.pop()
+        else:
+            stack.append(phase)
+
+    @contextmanager
+    def phase(self, phase: str):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            yield
+            return
+        self._switch(stack, phase)
+        try:
+            yield
+        finally:
+            self._switch(stack, None)
+
+    def wrap(self, phase: str, fn):
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with self.phase(phase):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.phase(phase):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    @contextmanager
+    def track(self, name: str):
+        """Times the current thread, recording the time spent in each phase as a run of name."""
+        self._local.stack = ["other"]
+        self._local.totals = defaultdict(float)
+        self._local.t0 = start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._switch(self._local.stack, None)
+            totals = {p: self._local.totals.get(p, 0.0) for p in PHASES}
+            totals["total"] = time.perf_counter() - start_time
+            del self._local.stack
+            with self._lock:
+                self.runs[name].append(totals)
+
+
+def instrument(timer: PhaseTimer, handlers) -> ExitStack:
+    """Patches the functions marking the start of each phase."""
+    import altair as alt
+    from nbclient import NotebookClient
+    from subgrounds.subgrounds import Subgrounds
+    from utils_notebook import pagination, vega
+    from utils_serverless import utils as utils_serverless
+    from utils_serverless.utils import NotebookRunner, StorageClient
+    from utils_serverless.kernels import KernelPool
+
+    patches = [
+        (KernelPool, "_start_kernel", "kernel_start"),
+        (NotebookClient, "async_start_new_kernel", "kernel_start"),
+        (NotebookRunner, "_load_module", "imports"),
+        (Subgrounds, "load_subgraph", "fetch"),
+        (Subgrounds, "execute", "fetch"),
+        (pagination, "query_df_split", "fetch"),
+        (pagination, "query_df_batch", "fetch"),
+        (pagination, "numeric_boundaries", "fetch"),
+        (NotebookRunner, "execute", "transforms"),
+        (vega, "output_chart", "spec_build"),
+        (alt.TopLevelMixin, "to_dict", "spec_build"),
+        (vega, "compute_width_paths", "width_paths"),
+        (StorageClient, "upload", "upload"),
+    ]
+    stack = ExitStack()
+    for obj, attr, phase in patches:
+        stack.enter_context(mock.patch.object(obj, attr, timer.wrap(phase, getattr(obj, attr))))
+    stack.enter_context(mock.patch.object(
+        handlers, "quantize_spec", timer.wrap("serialize", handlers.quantize_spec)
+    ))
+    for module in [handlers, utils_serverless]:
+        stack.enter_context(mock.patch.object(module, "dumps", timer.wrap("serialize", module.dumps)))
+    refresh_schema = handlers.refresh_schema
+    def refresh_schema_tracked(schema_name, force_refresh):
+        with timer.track(schema_name):
+            return refresh_schema(schema_name, force_refresh)
+    stack.enter_context(mock.patch.object(handlers, "refresh_schema", refresh_schema_tracked))
+    return stack
+
+
+def summarize(runs: List[Dict[str, float]]) -> Dict:
+    keys = ["total"] + PHASES
+    return {
+        "total": statistics.median(r["total"] for r in runs),
+        "phases": {p: statistics.median(r[p] for r in runs) for p in PHASES},
+        "runs": [{k: round(r[k], 6) for k in keys} for r in runs],
+    }
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float, min_delta: float) -> List[str]:
+    """Returns a description of every notebook phase that regressed relative to the baseline."""
+    regressions = []
+    for nb_name, nb_results in results["notebooks"].items():
+        nb_baseline = baseline["notebooks"].get(nb_name)
+        if nb_baseline is None:
+            continue
+        timings = {"total": nb_results["total"], **nb_results["phases"]}
+        timings_baseline = {"total": nb_baseline["total"], **nb_baseline["phases"]}
+        for key, secs in timings.items():
+            secs_baseline = timings_baseline.get(key)
+            if secs_baseline is None:
+                continue
+            if secs - secs_baseline > max(min_delta, tolerance * secs_baseline):
+                regressions.append(
+                    f"{nb_name:<30} {key:<14} {secs_baseline:8.3f}s -> {secs:8.3f}s"
+                )
+    return regressions
+
+
+def print_results(results: Dict) -> None:
+    abbrevs = {p: p[:10] for p in PHASES}
+    header = f"{'notebook':<30} {'total':>8} " + " ".join(f"{abbrevs[p]:>10}" for p in PHASES)
+    print(f"{'-'*len(header)}\n{header}\n{'-'*len(header)}")
+    notebooks = results["notebooks"]
+    for nb_name in sorted(notebooks, key=lambda k: notebooks[k]["total"]):
+        r = notebooks[nb_name]
+        print(
+            f"{nb_name:<30} {r['total']:8.3f} "
+            + " ".join(f"{r['phases'][p]:10.3f}" for p in PHASES)
+        )
+    totals = results["totals"]
+    print(f"{'-'*len(header)}")
+    print(f"{'total':<30} {totals['total']:8.3f} " + " ".join(f"{totals['phases'][p]:10.3f}" for p in PHASES))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark chart refreshes of all prod notebooks.')
+    parser.add_argument('--iterations', type=int, default=3, help='Refreshes per notebook')
+    parser.add_argument('--notebooks', help='Comma separated names of notebooks to refresh (default: all)')
+    parser.add_argument(
+        '--fixtures-dir',
+        default=os.environ.get("SUBGRAPH_FIXTURES_DIR"),
+        help='Subgraph fixtures served by the local subgraph stand-in'
+    )
+    parser.add_argument('--port', type=int, default=int(os.environ.get("SUBGRAPH_REPLAY_PORT", 8020)))
+    parser.add_argument(
+        '--latency-ms',
+        type=float,
+        default=float(os.environ.get("SUBGRAPH_REPLAY_LATENCY_MS", 0)),
+        help='Latency added to each subgraph response'
+    )
+    parser.add_argument('--output', default="benchmark_refresh.json", help='Path of the results file')
+    parser.add_argument('--baseline', default=str(PATH_BASELINE_DEFAULT), help='Path of the baseline results')
+    parser.add_argument(
+        '--write-baseline',
+        action='store_true',
+        help='Store these results as the baseline, rather than comparing against it'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.2,
+        help='Relative slowdown of a phase (vs. the baseline) reported as a regression'
+    )
+    parser.add_argument(
+        '--min-delta',
+        type=float,
+        default=0.05,
+        help='Slowdowns of fewer seconds than this are never reported as regressions'
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # Every run should fetch (and process) all of its data
+    for env_var in ["QUERY_CACHE_DIR", "QUERY_STORE_DIR", "QUERY_DF_CACHE_DIR", "SUBGRAPH_RECORD_DIR"]:
+        os.environ[env_var] = ""
+    os.environ["SUBGRAPH_URL"] = f"http://localhost:{args.port}/"
+
+    from emulate_storage import get_emulator_server
+    from replay_subgraph import create_server
+    from utils_notebook.fixtures import SubgraphFixtures
+
+    storage_server = get_emulator_server()
+    storage_server.start()
+    replay_server = create_server(SubgraphFixtures(args.fixtures_dir), args.port, args.latency_ms / 1000)
+    threading.Thread(target=replay_server.serve_forever, daemon=True).start()
+    try:
+        # Cold start, i.e. importing the handlers and the dependencies of notebooks
+        start_time = time.perf_counter()
+        import handlers
+        from utils_serverless.kernels import PRELOAD_SRC
+        exec(compile(PRELOAD_SRC, "<preload>", "exec"), {})
+        import_secs = time.perf_counter() - start_time
+        logging.getLogger().setLevel(logging.WARNING)
+        timer = PhaseTimer()
+        patches = instrument(timer, handlers)
+        setup_secs = time.perf_counter() - start_time
+
+        nb_names = args.notebooks.split(",") if args.notebooks else sorted(handlers.nbr.names)
+        with patches:
+            for i in range(args.iterations):
+                for nb_name in nb_names:
+                    request = SimpleNamespace(args={"data": nb_name, "force_refresh": "true"})
+                    statuses, code = handlers.handler_charts_refresh(request)
+                    if code != 200:
+                        raise RuntimeError(f"Refreshing {nb_name} failed: {statuses}")
+    finally:
+        replay_server.shutdown()
+        storage_server.wipe()
+        storage_server.stop()
+
+    notebooks = {nb_name: summarize(timer.runs[nb_name]) for nb_name in nb_names}
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "notebook_runner_mode": handlers.nbr.mode,
+            "iterations": args.iterations,
+            "subgraph_latency_ms": args.latency_ms,
+        },
+        "setup_seconds": setup_secs,
+        "import_seconds": import_secs,
+        "notebooks": notebooks,
+        "totals": {
+            "total": sum(r["total"] for r in notebooks.values()),
+            "phases": {p: sum(r["phases"][p] for r in notebooks.values()) for p in PHASES},
+        },
+    }
+    print_results(results)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {args.output}")
+
+    path_baseline = Path(args.baseline)
+    if args.write_baseline:
+        path_baseline.write_text(json.dumps(results, indent=2))
+        print(f"Baseline written to {path_baseline}")
+    elif not path_baseline.exists():
+        print(f"\nNo baseline at {path_baseline}, run with --write-baseline to create one.")
+        sys.exit(1)
+    else:
+        baseline = json.loads(path_baseline.read_text())
+        for key in ["notebook_runner_mode", "subgraph_latency_ms"]:
+            if baseline["meta"].get(key) != results["meta"][key]:
+                print(f"\nWarning: {key} of the baseline is {baseline['meta'].get(key)}, not {results['meta'][key]}")
+        missing = sorted(set(notebooks) - set(baseline["notebooks"]))
+        if missing:
+            print(f"\nNotebooks without a baseline (not compared): {', '.join(missing)}")
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) relative to {path_baseline}:")
+            print("\n".join(regressions))
+            sys.exit(1)
+        print(f"\nNo regressions relative to {path_baseline}.")
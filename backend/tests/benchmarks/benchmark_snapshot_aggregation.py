@@ -0,0 +1,90 @@
+"""Benchmark of the aggregation of daily snapshots into a single row per season.
+
+Each case is also aggregated with the previous implementation (kept here as a reference), which
+reduced fields with a python callable, and the benchmark fails if the two frames differ.
+"""
+import sys
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PATH_SRC = Path(__file__).parents[2] / "src"
+sys.path.append(str(PATH_SRC))
+from utils_notebook.queries import FIELD_DAILY_SNAPSHOTS
+from utils_notebook.constants import ADDR_BEANSTALK
+
+
+def get_last_row(row):
+    return row.iloc[-1]
+
+
+def aggregate_reference(df: pd.DataFrame) -> pd.DataFrame:
+    """Reference implementation, taking the last value of each season with a python callable."""
+    aggs = {
+        f.name: get_last_row if f.reducer == "last" else f.reducer
+        for f in FIELD_DAILY_SNAPSHOTS.fields
+    }
+    return (
+        df
+        .sort_values("timestamp")
+        .reset_index(drop=True)
+        .groupby('season')
+        .agg({k: v for k, v in aggs.items() if k in df.columns})
+        .reset_index()
+    )
+
+
+def time_fn(fn, df, iterations: int) -> float:
+    runtimes = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        fn(df)
+        runtimes.append(time.perf_counter() - start_time)
+    return statistics.median(runtimes)
+
+
+def snapshot_frames(n_seasons: int, rng: np.random.Generator):
+    """Yields (name, df) for field snapshots of n_seasons seasons, some of which have multiple
+    snapshots. Timestamps are unique, so that the last snapshot of each season is well defined.
+    """
+    szns = np.sort(np.concatenate([np.arange(1, n_seasons + 1), rng.integers(1, n_seasons, n_seasons // 10)]))
+    df = pd.DataFrame({
+        "season": szns,
+        "timestamp": pd.to_datetime(1_600_000_000 + np.arange(len(szns)) * 60, unit="s"),
+    })
+    for f in FIELD_DAILY_SNAPSHOTS.fields:
+        if f.name == "id":
+            df[f.name] = [f"{ADDR_BEANSTALK}-{s}" for s in szns]
+        elif f.name != "timestamp":
+            df[f.name] = rng.random(len(df)) * 1e9
+    yield "ordered", df
+    yield "shuffled", df.sample(frac=1, random_state=0)
+    yield "single_field", df[["season", "timestamp", "temperature"]]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the aggregation of daily snapshots.')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--seasons', type=int, default=20000, help='Number of seasons in each frame')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    header = f"{'snapshots':<24} {'rows':>8} {'callable (ms)':>14} {'native (ms)':>12} {'speedup':>8}"
+    print(f"{'-'*len(header)}\n{header}\n{'-'*len(header)}")
+    mismatches = []
+    for name, df in snapshot_frames(args.seasons, rng):
+        if not aggregate_reference(df).equals(FIELD_DAILY_SNAPSHOTS.aggregate(df)):
+            mismatches.append(name)
+        secs_reference = time_fn(aggregate_reference, df, args.iterations)
+        secs = time_fn(FIELD_DAILY_SNAPSHOTS.aggregate, df, args.iterations)
+        print(
+            f"{name:<24} {len(df):8d} {secs_reference * 1000:14.2f} "
+            f"{secs * 1000:12.2f} {secs_reference / secs:7.0f}x"
+        )
+    if mismatches:
+        print(f"\nFrames differ from the reference implementation for {mismatches}")
+        sys.exit(1)
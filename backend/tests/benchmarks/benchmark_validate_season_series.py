@@ -0,0 +1,109 @@
+"""Benchmark of testing.validate_season_series on wide and long form season series.
+
+Each case is also passed to the previous, Counter based implementation (kept here as a reference),
+and the benchmark fails if the two don't raise identical errors.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+PATH_SRC = Path(__file__).parents[2] / "src"
+sys.path.append(str(PATH_SRC))
+from utils_notebook.testing import validate_season_series
+
+
+def validate_season_series_counter(
+    df: pd.DataFrame,
+    season_col_name: str = "season",
+    allow_missing: bool = False,
+    count_expected: int = 1,
+):
+    """Reference implementation, counting seasons and checking their order in python."""
+    szns = df[season_col_name]
+    szn_min = szns.min()
+    szn_max = szns.max()
+    counter = Counter(szns.values.tolist())
+    missing = []
+    wrong_count = []
+    for s in range(szn_min, szn_max):
+        count = counter[s]
+        if count == 0:
+            missing.append(s)
+        if count != count_expected and not (allow_missing and count == 0):
+            wrong_count.append({"season": s, "count": count})
+    wrong_order = szns.values.tolist() != list(sorted(szns))
+    issues = []
+    if wrong_order:
+        issues.append("Order of series is not monotonically increasing\n")
+    if missing and not allow_missing:
+        issues.append(f"Missing: {json.dumps(missing, indent=4)}\n")
+    if wrong_count:
+        issues.append(f"Incorrect Count: {json.dumps(wrong_count, indent=4)}\n")
+    if issues:
+        raise ValueError(f"Season axis incorrect\n{''.join(issues)}")
+
+
+def error(fn, df, **kwargs):
+    try:
+        fn(df, **kwargs)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def time_fn(fn, df, iterations: int, **kwargs) -> float:
+    runtimes = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        error(fn, df, **kwargs)
+        runtimes.append(time.perf_counter() - start_time)
+    return statistics.median(runtimes)
+
+
+def season_frames(n_seasons: int, rng: np.random.Generator):
+    """Yields (name, df, kwargs) for valid and invalid series of n_seasons seasons."""
+    szns = np.arange(1, n_seasons + 1)
+    yield "wide", pd.DataFrame({"season": szns}), {}
+    yield "wide_missing", pd.DataFrame({"season": np.delete(szns, rng.choice(n_seasons - 1, 5))}), {}
+    yield (
+        "wide_missing_allowed",
+        pd.DataFrame({"season": np.delete(szns, rng.choice(n_seasons - 1, 5))}),
+        dict(allow_missing=True),
+    )
+    szns_unordered = szns.copy()
+    szns_unordered[[10, 20]] = szns_unordered[[20, 10]]
+    yield "wide_unordered", pd.DataFrame({"season": szns_unordered}), {}
+    yield "wide_duplicates", pd.DataFrame({"season": np.sort(np.append(szns, szns[:3]))}), {}
+    yield "long", pd.DataFrame({"season": np.repeat(szns, 8)}), dict(count_expected=8)
+    yield "long_wrong_count", pd.DataFrame({"season": np.repeat(szns, 8)[:-20]}), dict(count_expected=8)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark validate_season_series.')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--seasons', type=int, default=20000, help='Number of seasons in each series')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    header = f"{'series':<24} {'rows':>8} {'counter (ms)':>13} {'numpy (ms)':>11} {'speedup':>8}"
+    print(f"{'-'*len(header)}\n{header}\n{'-'*len(header)}")
+    mismatches = []
+    for name, df, kwargs in season_frames(args.seasons, rng):
+        if error(validate_season_series, df, **kwargs) != error(validate_season_series_counter, df, **kwargs):
+            mismatches.append(name)
+        secs_reference = time_fn(validate_season_series_counter, df, args.iterations, **kwargs)
+        secs = time_fn(validate_season_series, df, args.iterations, **kwargs)
+        print(
+            f"{name:<24} {len(df):8d} {secs_reference * 1000:13.2f} "
+            f"{secs * 1000:11.2f} {secs_reference / secs:7.0f}x"
+        )
+    if mismatches:
+        print(f"\nErrors differ from the reference implementation for {mismatches}")
+        sys.exit(1)
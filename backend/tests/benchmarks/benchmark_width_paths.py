@@ -0,0 +1,92 @@
+"""Benchmark of vega.compute_width_paths on the specs output by the prod notebooks.
+
+Specs are read from the outputs stored in the notebooks, so notebooks that were saved without
+outputs are skipped. Each spec is also passed to the previous, DeepSearch based implementation
+(kept here as a reference), and the benchmark fails if their width paths differ.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+from typing import Dict
+
+from deepdiff import DeepSearch
+from deepdiff.path import _path_to_elements
+
+PATH_SRC = Path(__file__).parents[2] / "src"
+sys.path.append(str(PATH_SRC))
+from utils_notebook.vega import compute_width_paths
+
+
+def compute_width_paths_deepsearch(schema: dict):
+    """Reference implementation, searching the whole schema (datasets included) once per property."""
+    def matched_paths(item, predicate):
+        return {
+            k: v for k, v in
+            DeepSearch(schema, item, verbose_level=2).get('matched_paths', {}).items()
+            if predicate(k)
+        }
+    m_width = {
+        **matched_paths('continuousWidth', lambda k: k == "root['config']['view']['continuousWidth']"),
+        **matched_paths('discreteWidth', lambda k: k == "root['config']['view']['discreteWidth']"),
+        **matched_paths('step', lambda k: k == "root['config']['view']['step']"),
+        **matched_paths('width', lambda k: k.endswith("['width']")),
+        **matched_paths('step', lambda k: k.endswith("['width']['step']")),
+    }
+    m_radius = {
+        **matched_paths("innerRadius", lambda k: k.endswith("['innerRadius']")),
+        **matched_paths("outerRadius", lambda k: k.endswith("['outerRadius']")),
+    }
+    wpaths = []
+    for factor, matches in [(1, m_width), (3.33, m_radius)]:
+        for wpath_key, wpath_value in matches.items():
+            wpath = [list(e)[0] for e in _path_to_elements(wpath_key)]
+            wpaths.append({"path": wpath[1:], "factor": factor, "value": wpath_value})
+    return wpaths
+
+
+def load_specs(path_notebooks: Path) -> Dict[str, dict]:
+    specs = {}
+    for nb_path in sorted(path_notebooks.glob("*.ipynb")):
+        nb = json.loads(nb_path.read_text())
+        for cell in nb["cells"]:
+            for output in cell.get("outputs", []):
+                data = output.get("data", {}).get("application/json")
+                if isinstance(data, dict) and "spec" in data:
+                    specs[nb_path.stem] = data["spec"]
+    return specs
+
+
+def time_fn(fn, spec, iterations: int) -> float:
+    runtimes = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        fn(spec)
+        runtimes.append(time.perf_counter() - start_time)
+    return statistics.median(runtimes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark compute_width_paths.')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--notebooks-dir', default=str(PATH_SRC / "notebooks" / "prod"))
+    args = parser.parse_args()
+
+    specs = load_specs(Path(args.notebooks_dir))
+    header = f"{'notebook':<30} {'spec (KB)':>10} {'deepsearch (ms)':>16} {'walker (ms)':>12} {'speedup':>8}"
+    print(f"{'-'*len(header)}\n{header}\n{'-'*len(header)}")
+    mismatches = []
+    for nb_name, spec in sorted(specs.items(), key=lambda e: len(json.dumps(e[1]))):
+        if compute_width_paths(spec) != compute_width_paths_deepsearch(spec):
+            mismatches.append(nb_name)
+        secs_reference = time_fn(compute_width_paths_deepsearch, spec, args.iterations)
+        secs = time_fn(compute_width_paths, spec, args.iterations)
+        print(
+            f"{nb_name:<30} {len(json.dumps(spec)) / 1024:10.0f} {secs_reference * 1000:16.2f} "
+            f"{secs * 1000:12.2f} {secs_reference / secs:7.0f}x"
+        )
+    if mismatches:
+        print(f"\nWidth paths differ from the reference implementation for {mismatches}")
+        sys.exit(1)
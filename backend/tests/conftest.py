@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# Unit tests import the utilities of the serverless code directly (the api tests use the build)
+PATH_SRC = Path(__file__).parents[1] / "src"
+sys.path.append(str(PATH_SRC))
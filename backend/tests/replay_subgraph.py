@@ -0,0 +1,69 @@
+"""Local stand-in for the subgraph, serving responses recorded with SUBGRAPH_RECORD_DIR.
+
+Point notebooks at it by setting SUBGRAPH_URL to http://localhost:<port>/. Requests
+that weren't recorded get a GraphQL error response. Run notebooks with the query cache
+and season store disabled, since their state changes which requests are made.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(str(Path(__file__).parents[1] / "src"))
+from utils_notebook.fixtures import SubgraphFixtures
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_server(fixtures: SubgraphFixtures, port: int, latency_seconds: float = 0):
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            data = fixtures.load(body["query"], body.get("variables"))
+            if data is None:
+                logger.warning(f"No fixture for request\n{body['query']}\n{body.get('variables')}")
+                resp = {"errors": [{"message": "No fixture recorded for this request"}]}
+            else:
+                resp = {"data": data}
+            # Simulates the round trip time to the subgraph
+            time.sleep(latency_seconds)
+            payload = json.dumps(resp).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer(("localhost", port), ReplayHandler)
+    logger.info(f"Serving subgraph fixtures from {fixtures.path} at localhost:{port}")
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve recorded subgraph responses.')
+    parser.add_argument(
+        '--fixtures-dir',
+        default=os.environ.get("SUBGRAPH_FIXTURES_DIR"),
+        help='Directory of fixtures recorded with SUBGRAPH_RECORD_DIR'
+    )
+    parser.add_argument('--port', type=int, default=8020)
+    parser.add_argument(
+        '--latency-ms',
+        type=float,
+        default=0,
+        help='Latency added to each response'
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = create_server(SubgraphFixtures(args.fixtures_dir), args.port, args.latency_ms / 1000)
+    server.serve_forever()
@@ -8,6 +8,7 @@ from utils import (
     get_test_api_client, 
     call_api_validate, 
     call_storage_validate, 
+    get_spec_data, 
 ) 
 
 
@@ -43,10 +44,7 @@ class TestApiLocal:
         schema_timestamps = dict()
         for schema_name in schema_names: 
             tstamp, schema = call_storage_validate(schema_name)
-            assert (
-                schema['datasets'][schema['data']['name']] 
-                == notebook_data[schema_name]
-            )
+            assert get_spec_data(schema) == notebook_data[schema_name]
             schema_timestamps[schema_name] = tstamp
         return schema_timestamps
 
@@ -0,0 +1,73 @@
+import fcntl
+import threading
+
+import pandas as pd
+
+from utils_notebook.cache import FrameCache, QueryCache, file_lock, remove_lock_file
+
+
+def test_evict_removes_lock_files(tmp_path):
+    cache = QueryCache(tmp_path, max_entries=2)
+    for i in range(5):
+        key = cache.key(i)
+        with cache.lock(key):
+            cache.set(key, i)
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == [".lock", ".lock", ".pkl", ".pkl"]
+    assert {p.stem for p in tmp_path.glob("*.lock")} == {p.stem for p in tmp_path.glob("*.pkl")}
+    cache.clear()
+    assert not list(tmp_path.iterdir())
+
+
+def test_evict_keeps_held_locks(tmp_path):
+    cache = QueryCache(tmp_path, max_entries=1)
+    key = cache.key("computing")
+    # The entry of key is being computed while other entries are written
+    with cache.lock(key):
+        cache.set(cache.key(1), 1)
+        cache.set(cache.key(2), 2)
+        assert (tmp_path / f"{key}.lock").exists()
+    cache.evict()
+    assert not list(tmp_path.glob("*.lock"))
+
+
+def test_frame_cache_evict_removes_lock_files(tmp_path):
+    cache = FrameCache(tmp_path, max_age_seconds=0)
+    key = cache.key("expired")
+    with cache.lock(key):
+        cache.set(key, pd.DataFrame({"a": [1]}), "expired")
+    cache.evict()
+    assert not list(tmp_path.iterdir())
+
+
+def test_remove_lock_file_held(tmp_path):
+    path = tmp_path / "key.lock"
+    assert not remove_lock_file(path)
+    with file_lock(path):
+        assert not remove_lock_file(path)
+    assert remove_lock_file(path)
+    assert not path.exists()
+
+
+def test_file_lock_retries_removed_file(tmp_path, monkeypatch):
+    path = tmp_path / "key.lock"
+    path.touch()
+    released = threading.Event()
+    flock = fcntl.flock
+
+    def release(f):
+        released.set()
+        flock(f, fcntl.LOCK_UN)
+        f.close()
+
+    def flock_after_removal(f, operation):
+        monkeypatch.setattr(fcntl, "flock", flock)
+        # Between opening and locking the file, it is removed and another notebook locks a new one
+        assert remove_lock_file(path)
+        other = path.open("w")
+        flock(other, fcntl.LOCK_EX)
+        threading.Timer(0.1, release, (other,)).start()
+        flock(f, operation)
+
+    monkeypatch.setattr(fcntl, "flock", flock_after_removal)
+    with file_lock(path):
+        assert released.is_set()
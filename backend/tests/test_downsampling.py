@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils_notebook.downsampling import downsample_timeseries, lttb_indices, minmax_indices
+
+
+def lttb_reference(x, y, n_out):
+    """Textbook Largest-Triangle-Three-Buckets, one point at a time."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return list(range(n))
+    every = (n - 2) / (n_out - 2)
+    kept = [0]
+    a = 0
+    for i in range(n_out - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        x_avg = sum(x[avg_start:avg_end]) / (avg_end - avg_start)
+        y_avg = sum(y[avg_start:avg_end]) / (avg_end - avg_start)
+        best, best_area = None, -1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((x[a] - x_avg) * (y[j] - y[a]) - (x[a] - x[j]) * (y_avg - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        kept.append(a)
+    kept.append(n - 1)
+    return kept
+
+
+def minmax_reference(x, y, n_out):
+    """First minimum and maximum of each of (n_out - 2) // 2 equal buckets, one bucket at a time."""
+    n = len(x)
+    if n_out >= n or n_out < 4:
+        return list(range(n))
+    n_buckets = (n_out - 2) // 2
+    kept = {0, n - 1}
+    for b in range(n_buckets):
+        bucket = range(int(b * n / n_buckets), int((b + 1) * n / n_buckets))
+        kept.add(min(bucket, key=lambda j: y[j]))
+        kept.add(max(bucket, key=lambda j: y[j]))
+    return sorted(kept)
+
+
+@pytest.mark.parametrize("indices_fn,reference", [
+    (lttb_indices, lttb_reference),
+    (minmax_indices, minmax_reference),
+])
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 5, 17, 1000, 1001])
+@pytest.mark.parametrize("n_out", [0, 3, 4, 7, 50, 1000])
+def test_indices_match_reference(indices_fn, reference, n, n_out):
+    rng = np.random.default_rng(n)
+    x = np.sort(rng.random(n))
+    # Few distinct values, so that buckets have ties
+    y = rng.integers(0, 5, n).astype(float)
+    assert indices_fn(x, y, n_out).tolist() == reference(x.tolist(), y.tolist(), n_out)
+
+
+@pytest.fixture
+def df_wide():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "timestamp": pd.date_range("2022-01-01", periods=500, freq="H"),
+        "a": rng.random(500),
+        "b": np.where(rng.random(500) < 0.3, np.nan, rng.random(500)),
+    })
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_downsample_timeseries_nan(df_wide, method):
+    result = downsample_timeseries(df_wide, "timestamp", ["a", "b"], 20, method)
+    # Each metric is downsampled without its missing values, then timestamps are combined
+    indices_fn = lttb_indices if method == "lttb" else minmax_indices
+    expected = set()
+    for m in ["a", "b"]:
+        series = df_wide[["timestamp", m]].dropna()
+        x = series.timestamp.astype("int64").to_numpy(float)
+        expected.update(series.timestamp.iloc[indices_fn(x, series[m].to_numpy(), 20)])
+    expected.add(df_wide.timestamp.max())
+    assert set(result.timestamp) == expected
+    pd.testing.assert_frame_equal(result, df_wide.loc[result.index])
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+@pytest.mark.parametrize("rows", [slice(0, 1), slice(0, 0)])
+def test_downsample_timeseries_small(df_wide, method, rows):
+    df = df_wide.iloc[rows]
+    if not len(df):
+        # The latest timestamp of an empty frame is undefined
+        with pytest.raises(ValueError):
+            downsample_timeseries(df, "timestamp", ["a", "b"], 20, method)
+        return
+    pd.testing.assert_frame_equal(downsample_timeseries(df, "timestamp", ["a", "b"], 20, method), df)
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_downsample_timeseries_longwide(df_wide, method):
+    df_long = df_wide.melt("timestamp", ["a", "b"]).dropna()
+    result = downsample_timeseries(df_long, "timestamp", ["a", "b"], 20, method, wide=False)
+    result_wide = downsample_timeseries(df_wide, "timestamp", ["a", "b"], 20, method)
+    assert set(result.timestamp) == set(result_wide.timestamp)
+
+
+def test_downsample_timeseries_invalid_method(df_wide):
+    with pytest.raises(ValueError, match="Invalid downsampling method"):
+        downsample_timeseries(df_wide, "timestamp", ["a"], 20, "every_nth")
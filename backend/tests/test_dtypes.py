@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from utils_notebook.dtypes import compact_dtypes, downcast_numeric
+
+
+ADDRESSES = [f"0x{i:040x}" for i in range(3)]
+
+
+def test_compact_dtypes():
+    df = pd.DataFrame({
+        "address": ADDRESSES * 2,
+        "season": np.arange(6),
+        "count": np.arange(6) * 1000,
+        "timestamp": np.arange(6) + 1650000000,
+        "amount": np.arange(6) * 2**40,
+        "price": [0.1, 0.2, np.nan, 0.4, 0.5, 0.6],
+        "name": ["a", "b", "c"] * 2,
+        "flag": [True, False] * 3,
+    })
+    expected = df.copy()
+    result = compact_dtypes(df)
+    assert result is df
+    assert result.dtypes.astype(str).to_dict() == {
+        "address": "category",
+        "season": "int64",
+        "count": "int16",
+        "timestamp": "int32",
+        "amount": "int64",
+        "price": "float64",
+        "name": "object",
+        "flag": "bool",
+    }
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_categorical=False)
+
+
+def test_compact_dtypes_keys():
+    df = pd.DataFrame({"season": [1, 2], "plot": [3, 4]})
+    assert compact_dtypes(df, keys=["plot"]).dtypes.astype(str).tolist() == ["int8", "int64"]
+
+
+def test_downcast_numeric_floats():
+    # Integer valued floats (integers with missing values) are exact as float32
+    s = pd.Series([np.nan, 250000.0, 1.0])
+    assert downcast_numeric(s).dtype == "float64"
+    assert downcast_numeric(s, floats=True).dtype == "float32"
+    # Values that float32 can't hold within 5e-4 stay float64
+    s = pd.Series([123456789.123, 1.0])
+    assert downcast_numeric(s, floats=True).dtype == "float64"
+
+
+def test_compact_dtypes_empty():
+    df = pd.DataFrame({"address": pd.Series(dtype=object), "count": pd.Series(dtype="int64")})
+    result = compact_dtypes(df)
+    assert result.dtypes.astype(str).tolist() == ["object", "int8"]
@@ -0,0 +1,47 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from utils_serverless.profiling import CellProfiler, rss_mb
+
+
+@pytest.fixture
+def tracing():
+    tracemalloc.start()
+    yield
+    tracemalloc.stop()
+
+
+def run_cells(profiler: CellProfiler, cells) -> list:
+    for i, cell in enumerate(cells):
+        profiler.start_cell(i, f"cell {i}")
+        cell()
+    profiler.end_cell()
+    return profiler.cells
+
+
+def test_cell_profile(tracing):
+    arrays = []
+    cells = run_cells(CellProfiler(), [
+        # Allocates (and keeps) 64MB
+        lambda: arrays.append(np.ones(2**23)),
+        # Allocates 64MB that are freed by the end of the cell
+        lambda: np.ones(2**23).sum(),
+        lambda: None,
+    ])
+    assert [c["cell"] for c in cells] == [0, 1, 2]
+    # Peaks are relative to the start of each cell, so they aren't carried over to later cells
+    assert [round(c["alloc_peak_mb"]) for c in cells] == [64, 64, 0]
+    if rss_mb() is not None:
+        assert cells[0]["rss_delta_mb"] > 60
+        assert abs(cells[1]["rss_delta_mb"]) < 16
+    # The process-wide peak never decreases
+    peaks = [c["process_peak_rss_mb"] for c in cells]
+    assert peaks == sorted(peaks)
+
+
+def test_cell_profile_not_tracing():
+    (cell,) = run_cells(CellProfiler(), [lambda: np.ones(2**20)])
+    assert cell["alloc_peak_mb"] is None
+    assert cell["wall_seconds"] >= 0 and cell["cpu_seconds"] >= 0
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils_notebook.queries import QueryManager, fill_missing_seasons
+
+
+@pytest.fixture
+def q():
+    # Queries that aren't sent never touch the subgraph
+    return QueryManager(sg=None, bs=None, cache=None, season_store=None)
+
+
+@pytest.mark.parametrize("name", [
+    "query_season_index", "query_plots", "query_farmers_deposited_bdv", "query_missing", "seasons",
+])
+def test_query_batch_unbatchable(q, name):
+    with pytest.raises(ValueError, match=f"{name} can't be batched"):
+        q.query_batch([("query_seasons", {}), (name, {})])
+
+
+def fill_missing_seasons_reference(df, fill_value=0):
+    # Previous gap filling of QueryManager._process_rewards_fertilizer, for any value columns
+    df = df.sort_values('season').reset_index(drop=True)
+    szns = df.season.unique()
+    missing_szns = [i for i in range(df.season.min(), df.season.max()) if i not in szns]
+    df_missing_szns = pd.DataFrame(
+        [{"season": i, **{c: fill_value for c in df.columns if c != "season"}} for i in missing_szns])
+    return pd.concat([df, df_missing_szns]).sort_values('season').reset_index(drop=True)
+
+
+@pytest.mark.parametrize("seasons,values", [
+    ([3, 7, 4, 10], [1, 2, 3, 4]),
+    ([3, 7, 4, 10], [1.5, np.nan, 3.0, np.nan]),
+    ([5, 6, 7], [1, 2, 3]),
+    ([5], [1]),
+])
+def test_fill_missing_seasons_matches_reference(seasons, values):
+    df = pd.DataFrame({"season": seasons, "reward_fertilized_beans": values})
+    expected = fill_missing_seasons_reference(df)
+    pd.testing.assert_frame_equal(fill_missing_seasons(df), expected)
+
+
+def test_fill_missing_seasons_empty():
+    # The previous implementation raised a TypeError
+    df = pd.DataFrame({"season": pd.Series(dtype=int), "reward_fertilized_beans": pd.Series(dtype=float)})
+    pd.testing.assert_frame_equal(fill_missing_seasons(df), df, check_index_type=False)
+
+
+def test_fill_missing_seasons_duplicates():
+    with pytest.raises(ValueError, match=r"multiple rows: \[2\]"):
+        fill_missing_seasons(pd.DataFrame({"season": [1, 2, 2, 4], "value": [1, 2, 3, 4]}))
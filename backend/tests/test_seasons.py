@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils_notebook.seasons import SeasonIndex
+
+
+@pytest.fixture
+def df_seasons():
+    # Season 4 is missing
+    return pd.DataFrame({
+        "season": [2, 3, 5, 6],
+        "timestamp": pd.to_datetime(["2022-01-01", "2022-01-02", "2022-01-04", "2022-01-05"]),
+        "beans": [1, 2, 4, 5],
+    })
+
+
+def test_from_frame(df_seasons):
+    index = SeasonIndex.from_frame(df_seasons)
+    assert (index.first_season, index.last_season, len(index)) == (2, 6, 5)
+    assert index.lookup(5, "beans") == 4
+    with pytest.raises(KeyError):
+        index.lookup(7)
+
+
+def test_from_frame_duplicate_seasons(df_seasons):
+    with pytest.raises(ValueError, match="multiple rows"):
+        SeasonIndex.from_frame(pd.concat([df_seasons, df_seasons.iloc[:1]]))
+
+
+@pytest.mark.parametrize("seasons", [
+    [6, 2, 3],
+    # Missing season, seasons before and after the index, and repeated seasons
+    [4, 1, 7, 3, 3],
+    [],
+    [5],
+])
+def test_attach_matches_merge(df_seasons, seasons):
+    df = pd.DataFrame(
+        {"season": seasons, "value": np.arange(len(seasons), dtype=float)},
+        index=np.arange(len(seasons)) * 2,
+    )
+    expected = df.merge(df_seasons, how="left", on="season").set_index(df.index)
+    # Merges of empty frames don't keep the order of columns
+    expected = expected[["season", "value", "timestamp", "beans"]]
+    result = SeasonIndex.from_frame(df_seasons).attach(df)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert result.timestamp.dtype == df_seasons.timestamp.dtype
+
+
+def test_attach_renames_columns(df_seasons):
+    df = pd.DataFrame({"szn": [3, 5]})
+    result = SeasonIndex.from_frame(df_seasons).attach(df, {"timestamp": "ts"}, season_col="szn")
+    assert result.columns.tolist() == ["szn", "ts"]
+    assert result.ts.tolist() == pd.to_datetime(["2022-01-02", "2022-01-04"]).tolist()
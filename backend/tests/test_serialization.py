@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from utils_serverless.serialization import format_decimals, quantize_spec
+
+
+MAGNITUDES = np.array([-3, 0, 2, 6])
+
+
+@pytest.mark.parametrize("fmt,decimals", [
+    (",.2f", [2, 2, 2, 2]),
+    (".0f", [0, 0, 0, 0]),
+    # Fixed point after multiplying by 100
+    (".2%", [4, 4, 4, 4]),
+    ("%", [8, 8, 8, 8]),
+    (",d", [0, 0, 0, 0]),
+    # precision + 1 significant digits
+    (".2e", [5, 2, 0, -4]),
+    (".0e", [3, 0, -2, -6]),
+    ("e", [9, 6, 4, 0]),
+    # precision significant digits
+    (".3s", [5, 2, 0, -4]),
+    (".3g", [5, 2, 0, -4]),
+    (".0r", [3, 0, -2, -6]),
+])
+def test_format_decimals(fmt, decimals):
+    assert format_decimals(fmt)(MAGNITUDES).tolist() == decimals
+
+
+@pytest.mark.parametrize("fmt", [",", "", "$,", "not a format"])
+def test_format_decimals_unbounded(fmt):
+    assert format_decimals(fmt) is None
+
+
+def spec_with_data(rows, layers):
+    return {"datasets": {"data-1": rows}, "data": {"name": "data-1"}, "layer": layers}
+
+
+def test_quantize_spec_tooltip():
+    spec = spec_with_data(
+        [{"price": 1.23456789, "share": 0.123456789}, {"price": 1234.56789, "share": 0.5}],
+        [{"mark": "rule", "encoding": {"tooltip": [
+            {"field": "price", "type": "quantitative", "format": ",.2f"},
+            {"field": "share", "type": "quantitative", "format": ".2%"},
+        ]}}],
+    )
+    rows = quantize_spec(spec, 4)["datasets"]["data-1"]
+    # At least 4 significant digits, and every digit displayed by the format
+    assert rows[0] == {"price": 1.235, "share": 0.1235}
+    assert rows[1] == {"price": 1234.57, "share": 0.5}
+
+
+def test_quantize_spec_axis():
+    spec = spec_with_data(
+        [{"t": 1.0, "supply": 123456789.123}],
+        [{"mark": "line", "encoding": {
+            "x": {"field": "t", "type": "ordinal"},
+            "y": {"field": "supply", "type": "quantitative", "axis": {"format": ".2s"}},
+        }}],
+    )
+    assert quantize_spec(spec, 4)["datasets"]["data-1"] == [{"t": 1.0, "supply": 123500000.0}]
+
+
+def test_quantize_spec_expression():
+    # Mirrors vega.chart_address_value_table, which formats values within a calculate transform
+    spec = spec_with_data(
+        [{"address": "0x0", "bdv": 9876543.21}, {"address": "0x1", "bdv": 9876543.19}],
+        [{
+            "mark": "text",
+            "transform": [
+                {"fold": ["address", "bdv"]},
+                {"calculate": "datum.key === 'bdv' ? format(datum.value, ',d') : datum.value", "as": "label"},
+            ],
+            "encoding": {"text": {"field": "label", "type": "nominal"}},
+        }],
+    )
+    rows = quantize_spec(spec, 4)["datasets"]["data-1"]
+    assert [row["bdv"] for row in rows] == [9876543.21, 9876543.19]
+
+
+def test_quantize_spec_unformatted():
+    spec = spec_with_data(
+        [{"count": 12345.678, "value": 12345.678}],
+        [{"mark": "bar", "encoding": {
+            "y": {"field": "value", "type": "quantitative"},
+            "tooltip": [{"field": "count", "type": "quantitative"}],
+        }}],
+    )
+    assert quantize_spec(spec, 4)["datasets"]["data-1"] == [{"count": 12345.678, "value": 12345.678}]
+
+
+def test_quantize_spec_pivot():
+    # Mirrors vega.chart, where tooltips display the values of metrics pivoted from "value"
+    spec = spec_with_data(
+        [{"t": "a", "variable": "share", "value": 0.123456789}],
+        [{
+            "mark": "rule",
+            "transform": [{"pivot": "variable", "value": "value", "groupby": ["t"]}],
+            "encoding": {"tooltip": [{"field": "share", "type": "quantitative", "format": ".2%"}]},
+        }],
+    )
+    assert quantize_spec(spec, 4)["datasets"]["data-1"][0]["value"] == 0.1235
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.benchmark_snapshot_aggregation import aggregate_reference, snapshot_frames
+from utils_notebook.queries import FIELD_DAILY_SNAPSHOTS
+from utils_notebook.snapshots import SnapshotAggregation, SnapshotField
+
+
+@pytest.fixture
+def df_snapshots():
+    (_, df), *_ = snapshot_frames(200, np.random.default_rng(0))
+    return df
+
+
+@pytest.mark.parametrize("rows", [
+    slice(None),
+    # A single row
+    slice(0, 1),
+    # Empty frame
+    slice(0, 0),
+])
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_aggregate_matches_reference(df_snapshots, rows, shuffle):
+    df = df_snapshots.iloc[rows]
+    if shuffle:
+        df = df.sample(frac=1, random_state=0)
+    pd.testing.assert_frame_equal(FIELD_DAILY_SNAPSHOTS.aggregate(df), aggregate_reference(df))
+
+
+def test_aggregate_missing_seasons(df_snapshots):
+    df = df_snapshots.loc[~df_snapshots.season.isin([3, 4, 50])]
+    result = FIELD_DAILY_SNAPSHOTS.aggregate(df)
+    pd.testing.assert_frame_equal(result, aggregate_reference(df))
+    assert not result.season.isin([3, 4, 50]).any()
+
+
+def test_aggregate_nan():
+    df = pd.DataFrame({
+        "season": [1, 1, 2, 2],
+        "timestamp": pd.to_datetime([1, 2, 3, 4], unit="s"),
+        "temperature": [1.0, np.nan, np.nan, np.nan],
+        "deltaSoil": [1.0, np.nan, 2.0, 3.0],
+    })
+    result = FIELD_DAILY_SNAPSHOTS.aggregate(df)
+    expected = aggregate_reference(df)
+    # Unlike the previous get_last_row reducer, "last" skips nulls
+    assert result.temperature.tolist()[0] == 1.0 and np.isnan(expected.temperature[0])
+    pd.testing.assert_frame_equal(result.drop(columns="temperature"), expected.drop(columns="temperature"))
+    assert np.isnan(result.temperature[1])
+
+
+def test_aggregate_unknown_column(df_snapshots):
+    with pytest.raises(ValueError, match=r"without a reducer: \['unknown'\]"):
+        FIELD_DAILY_SNAPSHOTS.aggregate(df_snapshots.assign(unknown=1))
+
+
+@pytest.mark.parametrize("fields,match", [
+    ([SnapshotField("a", "last"), SnapshotField("a", "max")], "multiple reducers"),
+    ([SnapshotField("season", "last")], "season column"),
+    ([SnapshotField("a", "median")], "Unknown reducers"),
+])
+def test_invalid_spec(fields, match):
+    with pytest.raises(ValueError, match=match):
+        SnapshotAggregation(tuple(fields))
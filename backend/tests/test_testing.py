@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.benchmark_validate_season_series import validate_season_series_counter
+from utils_notebook.testing import validate_season_series
+
+
+def error(fn, df, **kwargs):
+    try:
+        fn(df, **kwargs)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+@pytest.mark.parametrize("seasons,kwargs", [
+    ([1, 2, 3, 4], {}),
+    ([5], {}),
+    ([1, 2, 4, 7], {}),
+    ([1, 2, 4, 7], dict(allow_missing=True)),
+    ([1, 3, 2, 4], {}),
+    ([1, 2, 2, 3], {}),
+    ([1, 1, 2, 2, 3, 3], dict(count_expected=2)),
+    ([1, 1, 2, 3, 3], dict(count_expected=2)),
+    ([1, 1, 3, 3, 4], dict(count_expected=2, allow_missing=True)),
+    ([4, 3, 1, 1], {}),
+])
+def test_validate_season_series_matches_reference(seasons, kwargs):
+    df = pd.DataFrame({"season": seasons})
+    assert error(validate_season_series, df, **kwargs) == error(validate_season_series_counter, df, **kwargs)
+
+
+def test_validate_season_series_empty():
+    # The previous implementation raised a TypeError
+    with pytest.raises(ValueError, match="Series is empty"):
+        validate_season_series(pd.DataFrame({"season": pd.Series(dtype=int)}))
+
+
+def test_validate_season_series_nan():
+    df = pd.DataFrame({"season": [1, np.nan, 3]})
+    for fn in [validate_season_series, validate_season_series_counter]:
+        with pytest.raises(TypeError):
+            fn(df)
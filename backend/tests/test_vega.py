@@ -0,0 +1,123 @@
+from pathlib import Path
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.benchmark_width_paths import compute_width_paths_deepsearch, load_specs
+from utils_notebook.vega import (
+    chart, compute_width_paths, exploit_day_expr, is_exploit_day, wide_to_longwide
+)
+
+PATH_NOTEBOOKS = Path(__file__).parents[1] / "src" / "notebooks" / "prod"
+
+
+def spec_rows(spec: dict) -> list:
+    (rows,) = spec["datasets"].values()
+    return rows
+
+
+@pytest.fixture
+def df_hourly():
+    # Hourly series around the exploit, so that exploit day rows are a small share of the rows
+    rng = np.random.default_rng(0)
+    ts = pd.date_range("2022-01-01", "2022-08-01", freq="H")
+    return pd.DataFrame({
+        "timestamp": ts,
+        "a": rng.random(len(ts)).cumsum(),
+        "b": rng.random(len(ts)).cumsum(),
+    })
+
+
+def test_is_exploit_day():
+    ts = pd.Series(pd.to_datetime(["2022-03-16", "2022-04-16 12:00", "2022-04-17", "2023-04-16"]))
+    assert is_exploit_day(ts, 16).tolist() == [False, True, False, False]
+    assert is_exploit_day(ts, 17).tolist() == [False, False, True, False]
+
+
+def test_exploit_day_expr():
+    # Vega months are 0-based, so April is 3
+    assert exploit_day_expr("timestamp", 16) == (
+        "year(datum['timestamp']) === 2022 && month(datum['timestamp']) === 3 && "
+        "date(datum['timestamp']) === 16"
+    )
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+@pytest.mark.parametrize("fold", [True, False])
+def test_chart_downsampling_keeps_exploit_day(df_hourly, method, fold):
+    df = df_hourly if fold else wide_to_longwide(df_hourly, "timestamp", ["timestamp"], ["a", "b"])
+    c = chart(
+        df, "timestamp", ["a", "b"], fold=["a", "b"] if fold else None,
+        max_points=50, downsample_method=method, exploit_day=16,
+    )
+    rows = spec_rows(c.to_dict())
+    timestamps = pd.to_datetime(pd.Series([row["timestamp"] for row in rows])).drop_duplicates()
+    assert len(timestamps) < len(df_hourly)
+    kept = timestamps[is_exploit_day(timestamps, 16)]
+    assert len(kept) == 24
+    # The same day of the previous month is downsampled like any other day
+    assert len(timestamps[is_exploit_day(timestamps + pd.DateOffset(months=1), 16)]) < 24
+    assert timestamps.max() == df_hourly.timestamp.max()
+
+
+def without_datasets(spec: dict) -> dict:
+    # The reference searches datasets too, which only slows it down since they hold no widths
+    return {k: v for k, v in spec.items() if k != "datasets"}
+
+
+@pytest.mark.parametrize("name,spec", sorted(load_specs(PATH_NOTEBOOKS).items()))
+def test_compute_width_paths_notebook_specs(name, spec):
+    spec = without_datasets(spec)
+    assert compute_width_paths(spec) == compute_width_paths_deepsearch(spec)
+
+
+def test_compute_width_paths_charts():
+    df = pd.DataFrame({"category": ["a", "b"], "value": [1, 2]})
+    bars = alt.Chart(df).mark_bar().encode(x="category:N", y="value:Q").properties(width=alt.Step(20))
+    arcs = alt.Chart(df).mark_arc(innerRadius=20, outerRadius=50).encode(theta="value:Q")
+    spec = without_datasets(
+        alt.hconcat(alt.vconcat(bars, bars.properties(width=300)), arcs)
+        .configure_view(continuousWidth=400, discreteWidth=150, step=10)
+        .to_dict()
+    )
+    wpaths = compute_width_paths(spec)
+    assert wpaths == compute_width_paths_deepsearch(spec)
+    paths = [(w["path"], w["value"]) for w in wpaths]
+    for path in [
+        (["config", "view", "continuousWidth"], 400),
+        (["config", "view", "discreteWidth"], 150),
+        (["hconcat", 0, "vconcat", 0, "width", "step"], 20),
+        (["hconcat", 0, "vconcat", 1, "width"], 300),
+        (["hconcat", 1, "mark", "outerRadius"], 50),
+    ]:
+        assert path in paths
+
+
+@pytest.mark.parametrize("spec", [
+    {},
+    {"config": {}},
+    {"mark": "line", "width": 100},
+    {"layer": [{"mark": {"type": "arc", "innerRadius": 10}}], "config": {"view": {"discreteWidth": 30}}},
+])
+def test_compute_width_paths_small_specs(spec):
+    assert compute_width_paths(spec) == compute_width_paths_deepsearch(spec)
+
+
+def test_compute_width_paths_discrete_width_step():
+    # The previous implementation returned the discreteWidth object, which the frontend can't scale
+    spec = {"config": {"view": {"discreteWidth": {"step": 15}}}}
+    assert compute_width_paths(spec) == [
+        {"path": ["config", "view", "discreteWidth", "step"], "factor": 1, "value": 15}
+    ]
+
+
+def test_compute_width_paths_skips_datasets():
+    spec = {"datasets": {"data-1": [{"width": 3}]}, "data": {"name": "data-1"}, "width": 100}
+    assert compute_width_paths(spec) == [{"path": ["width"], "factor": 1, "value": 100}]
+
+
+def test_compute_width_paths_autosize_fit():
+    with pytest.raises(ValueError, match="autosize fit"):
+        compute_width_paths({"autosize": {"type": "fit"}})
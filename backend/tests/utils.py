@@ -90,4 +90,18 @@ def call_storage_validate(schema_name) -> Tuple[datetime.datetime, dict]:
             assert css is None or isinstance(css, str)
         case _: 
             assert False, "Object returned from storage has incorrect structure"
-    return tstamp, spec 
\ No newline at end of file
+    return tstamp, spec
+
+
+def get_spec_data(spec: dict) -> list: 
+    """Returns the values of the top level dataset of a spec, which is either stored 
+    inline (in spec['datasets']) or as a separate object referenced by url. 
+    """
+    match spec['data']: 
+        case {"name": name}: 
+            return spec['datasets'][name]
+        case {"url": url}: 
+            resp = requests.get(url)
+            assert resp.status_code == 200
+            return resp.json()
+    assert False, "Spec has no top level data"
@@ -1,19 +1,87 @@
 """Creates a directory containing code to deploy as a google cloud function. """
 import os 
 import re 
+import ast 
 import shutil
 import logging 
 import argparse 
 from pathlib import Path
+from typing import List
 
 import nbformat
 from nbformat.v4 import new_code_cell, new_notebook
+from IPython.core.inputtransformer2 import TransformerManager
 
 from safe_rmtree import safe_rmtree
 
 
 logger = logging.getLogger(__name__)
 
+MODULE_HEADER = '''"""Generated from {nb_name} by scripts/python/create_serverless_code.py
+
+Do not edit, this file is re-generated with every build. 
+"""
+'''
+
+MODULE_FOOTER = '''
+
+class _NoProfiler: 
+
+    def start_cell(self, index: int, label: str = "") -> None: 
+        pass 
+
+
+def run(profiler=None) -> dict: 
+    """Executes the notebook source and returns the notebook output (spec, width_paths, css).
+    
+    The start of each notebook cell is reported to profiler (see utils_serverless.profiling.CellProfiler). 
+    """
+    output = _run(profiler or _NoProfiler())
+    # output_chart wraps its output in an IPython display object 
+    return getattr(output, "data", output)
+'''
+
+
+def cell_label(src: str) -> str: 
+    """Short description of a cell, i.e. its first non-empty line (as in CellProfiler.label)."""
+    lines = [l.strip() for l in src.splitlines() if l.strip()]
+    return lines[0][:80] if lines else ""
+
+
+def create_notebook_module(nb_name: str, cell_srcs: List[str]) -> str: 
+    """Converts the source code of notebook cells into the source code of a python module. 
+
+    The notebook source becomes the body of a function, with the final expression 
+    of the notebook (its output) as the return value. This allows the notebook to be 
+    executed in-process by calling `run` rather than executing it within a kernel. 
+    Each cell is preceded by a call to `_profiler.start_cell`, so that cells can be profiled. 
+    """
+    body = []
+    for i, cell_src in enumerate(cell_srcs): 
+        # Converts any IPython specific syntax (magics, etc.) into python 
+        tree = ast.parse(TransformerManager().transform_cell(cell_src))
+        for node in ast.walk(tree): 
+            if isinstance(node, ast.ImportFrom) and any(a.name == "*" for a in node.names): 
+                raise ValueError(f"Notebook {nb_name} uses a wildcard import, which can't be compiled into a module.")
+        if not tree.body: 
+            continue 
+        marker = ast.parse(f"_profiler.start_cell({i}, {cell_label(cell_src)!r})").body
+        body.extend(marker + tree.body)
+    if not (body and isinstance(body[-1], ast.Expr)): 
+        raise ValueError(f"Notebook {nb_name} must end with an expression that outputs the chart.")
+    body[-1] = ast.Return(value=body[-1].value)
+    fn = ast.FunctionDef(
+        name="_run", 
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg="_profiler")], kwonlyargs=[], kw_defaults=[], defaults=[]), 
+        body=body, 
+        decorator_list=[], 
+        returns=None, 
+    )
+    module = ast.fix_missing_locations(ast.Module(body=[fn], type_ignores=[]))
+    module_src = MODULE_HEADER.format(nb_name=nb_name) + "\n\n" + ast.unparse(module) + "\n" + MODULE_FOOTER
+    compile(module_src, nb_name, "exec") # fail the build rather than at runtime 
+    return module_src 
+
 
 def create_serverless_code(): 
 
@@ -40,12 +108,14 @@ def create_serverless_code():
         path_notebooks = DIR_DST / rpath
         for fpath in filter(lambda p: p.suffix == '.ipynb', path_notebooks.iterdir()): 
             nb = nbformat.read(fpath, as_version=4)
-            src = '\n'.join(
-                [c['source'] for c in nb['cells'] if c['cell_type'] == 'code']
-            )
+            cell_srcs = [c['source'] for c in nb['cells'] if c['cell_type'] == 'code']
+            src = '\n'.join(cell_srcs)
             new_nb = new_notebook(cells=[new_code_cell(cell_type="code", source=src)])
             nbformat.write(new_nb, str(fpath))
             logging.info(f"Processed notebook {fpath}")
+            # Module version of the notebook, used when notebooks are run in-process 
+            fpath.with_suffix(".py").write_text(create_notebook_module(fpath.name, cell_srcs))
+            logging.info(f"Created module {fpath.with_suffix('.py')}")
 
 
 if __name__ == "__main__": 